@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+"""
+convert_milthm_assets.py 的离线基准测试
+生成合成插图语料（不同尺寸、有无 alpha、JPG/PNG）与包含大量歌曲的假 out.json，
+测量 convert_image 在不同执行器、worker 数、格式、质量下的吞吐（张/秒、MB/秒）与 RSS 峰值，
+以及 parse_out_json、alpha 拍平和完整 main() 的耗时。
+结果为 JSON，可与保存的基线对比，发现回归时以非零状态退出。
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import as_completed
+from pathlib import Path
+
+from PIL import Image
+
+# 导入时会同时把 stdout/stderr 设为 UTF-8
+import convert_milthm_assets as conv
+
+PROJECT_ROOT = Path(__file__).parent
+DEFAULT_BASELINE = PROJECT_ROOT / "bench" / "baseline.json"
+BENCH_VERSION = 1
+
+# 合成插图尺寸（宽, 高）：覆盖常见封面与大尺寸主视觉
+CORPUS_SIZES = ((800, 450), (1600, 900), (2560, 1440), (1024, 1024))
+
+
+def log(message: str):
+    """进度与对比结果写到 stderr：未指定 --output 时 stdout 只有 JSON 报告，可以直接重定向或用管道解析"""
+    print(message, file=sys.stderr, flush=True)
+
+
+def generate_image(size: tuple[int, int], alpha: bool, rng: random.Random) -> Image.Image:
+    """渐变 + 噪声 + 色块，接近真实插图的编码难度"""
+    width, height = size
+    gradient = Image.linear_gradient("L").resize(size)
+    noise = Image.effect_noise(size, rng.uniform(20, 60))
+    base = Image.merge("RGB", (gradient, noise, gradient.rotate(90).resize(size)))
+    for _ in range(24):
+        x, y = rng.randrange(width), rng.randrange(height)
+        w, h = rng.randrange(width // 8 + 1), rng.randrange(height // 8 + 1)
+        color = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+        base.paste(color, (x, y, min(width, x + w), min(height, y + h)))
+    if alpha:
+        base.putalpha(Image.radial_gradient("L").resize(size))
+    return base
+
+
+def generate_corpus(root: Path, count: int, seed: int) -> list[Path]:
+    """生成 count 张插图：PNG 有/无 alpha 与 JPG 交替，尺寸轮换"""
+    rng = random.Random(seed)
+    root.mkdir(parents=True, exist_ok=True)
+    paths: list[Path] = []
+    for i in range(count):
+        size = CORPUS_SIZES[i % len(CORPUS_SIZES)]
+        kind = i % 3
+        if kind == 2:
+            path = root / f"illust_{i:04d}.jpg"
+            generate_image(size, False, rng).save(path, "JPEG", quality=92)
+        else:
+            path = root / f"illust_{i:04d}.png"
+            generate_image(size, kind == 0, rng).save(path, "PNG", compress_level=6)
+        paths.append(path)
+    return paths
+
+
+def generate_out_json(path: Path, songs: int, illustrations: list[str], seed: int):
+    """生成与 MilResource out.json 结构一致的假数据：每首歌 1~4 个难度"""
+    rng = random.Random(seed)
+    chapters = []
+    per_chapter = 100
+    for start in range(0, songs, per_chapter):
+        chapter_songs = []
+        for i in range(start, min(songs, start + per_chapter)):
+            illustration = illustrations[i % len(illustrations)] if illustrations else f"missing_{i}.png"
+            title = f"合成曲目 {i}"
+            levels = [
+                {
+                    "BeatmapId": f"{i:08x}-{level:04x}-bench",
+                    "MetaData": {"Title": title if level else f"{title} (Another)"},
+                }
+                for level in range(rng.randint(1, 4))
+            ]
+            chapter_songs.append(
+                {
+                    "SharingMetaData": {
+                        "Title": title,
+                        "IllustrationUri": f"resource/illustration/{Path(illustration).stem}.milimg",
+                    },
+                    "Levels": levels,
+                }
+            )
+        chapters.append({"Songs": chapter_songs})
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(chapters, f, ensure_ascii=False)
+
+
+def run_measured(command: list[str]) -> tuple[str, int]:
+    """
+    以子进程运行 command，返回 (stdout, RSS 峰值 KB)。
+    峰值取自 wait4 返回的该子进程树的资源用量：ru_maxrss 是进程生命周期内的最高值，
+    在本进程里用 RUSAGE_SELF/RUSAGE_CHILDREN 统计会混入之前各项配置与语料生成的峰值
+    """
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE, text=True, encoding="utf-8")
+    assert proc.stdout is not None
+    stdout = proc.stdout.read()
+    proc.stdout.close()
+    peak = 0
+    if hasattr(os, "wait4"):
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        peak = usage.ru_maxrss // 1024 if sys.platform == "darwin" else usage.ru_maxrss
+    else:  # Windows
+        proc.wait()
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, command)
+    return stdout, peak
+
+
+def measure_convert(
+    corpus_dir: Path, output_dir: Path, executor_kind: str, workers: int, fmt: str, quality: int
+) -> dict:
+    """在新的子进程中运行一项 bench_convert 配置，RSS 峰值只包含这一项"""
+    spec = {
+        "corpus": str(corpus_dir),
+        "output": str(output_dir),
+        "executor": executor_kind,
+        "workers": workers,
+        "format": fmt,
+        "quality": quality,
+    }
+    stdout, peak = run_measured(
+        [sys.executable, str(Path(__file__).resolve()), "--measure-convert", json.dumps(spec)]
+    )
+    item = json.loads(stdout)
+    item["peak_rss_kb"] = peak
+    return item
+
+
+def bench_convert(
+    corpus: list[Path], output_dir: Path, executor_kind: str, workers: int, fmt: str, quality: int
+) -> dict:
+    """用指定执行器转换整个语料，返回吞吐数据（RSS 峰值由 measure_convert 在父进程中测量）"""
+    shutil.rmtree(output_dir, ignore_errors=True)
+    suffix = ".webp" if fmt == "WEBP" else ".avif"
+    bytes_in = sum(p.stat().st_size for p in corpus)
+    started = time.perf_counter()
+    results = []
+    with conv.create_executor(executor_kind, workers) as executor:
+        futures = [
+            executor.submit(conv.convert_image, path, output_dir / (path.stem + suffix), quality, fmt)
+            for path in corpus
+        ]
+        for future in as_completed(futures):
+            results.append(future.result())
+    wall = time.perf_counter() - started
+
+    failed = [r for r in results if not r.ok]
+    if failed:
+        raise RuntimeError(f"{len(failed)} 张图片转换失败，例如 {failed[0].source}: {failed[0].error}")
+    return {
+        "name": f"convert/{executor_kind}/w{workers}/{fmt}/q{quality}",
+        "images": len(results),
+        "wall_seconds": round(wall, 6),
+        "images_per_sec": round(len(results) / wall, 4) if wall > 0 else 0.0,
+        "mb_per_sec": round(bytes_in / 1024 / 1024 / wall, 4) if wall > 0 else 0.0,
+        "bytes_in": bytes_in,
+        "bytes_out": sum(r.target_bytes for r in results),
+    }
+
+
+def legacy_flatten(img: Image.Image) -> Image.Image:
+    """拍平的旧实现（新建白底 + split 取 alpha + paste），作为微基准的对照"""
+    background = Image.new("RGB", img.size, (255, 255, 255))
+    mask = img.split()[3] if img.mode == "RGBA" else img.split()[1]
+    background.paste(img, mask=mask)
+    return background
+
+
+def bench_flatten(size: tuple[int, int], repeat: int, seed: int) -> list[dict]:
+    """
+    对比拍平的旧实现与 flatten_alpha：取 repeat 次中的最短耗时，
+    并用 Pillow 的 core 统计记录每次调用新分配的图像数量
+    """
+    img = generate_image(size, True, random.Random(seed))
+    results = []
+    for name, flatten in (("legacy", legacy_flatten), ("buffered", conv.flatten_alpha)):
+        flatten(img)  # 预热：flatten_alpha 首次调用时分配缓冲区
+        best = float("inf")
+        allocated = 0
+        for _ in range(repeat):
+            before = Image.core.get_stats()["new_count"]
+            started = time.perf_counter()
+            flatten(img)
+            best = min(best, time.perf_counter() - started)
+            allocated = Image.core.get_stats()["new_count"] - before
+        results.append(
+            {
+                "name": f"flatten/{name}/{size[0]}x{size[1]}",
+                "seconds": round(best, 6),
+                "images_allocated": allocated,
+                "mpx_per_sec": round(size[0] * size[1] / 1_000_000 / best, 2) if best > 0 else 0.0,
+            }
+        )
+    return results
+
+
+def bench_parse(out_json_path: Path, songs: int, repeat: int) -> dict:
+    """parse_out_json 取 repeat 次中的最短耗时"""
+    best = float("inf")
+    titles = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        titles = len(conv.parse_out_json(out_json_path))
+        best = min(best, time.perf_counter() - started)
+    return {
+        "name": f"parse_out_json/songs{songs}",
+        "titles": titles,
+        "seconds": round(best, 6),
+        "songs_per_sec": round(songs / best, 2) if best > 0 else 0.0,
+    }
+
+
+def bench_main(corpus: list[Path], songs: int, workdir: Path, extra_args: list[str], seed: int) -> dict:
+    """在临时目录中搭建与仓库相同的布局，以子进程运行一次完整的 --full 构建"""
+    tree = workdir / "tree"
+    shutil.rmtree(tree, ignore_errors=True)
+    resource_root = tree / "third_party" / "MilResource" / "resource"
+    illustration_dir = resource_root / "illustration"
+    illustration_dir.mkdir(parents=True)
+    pngs = [p for p in corpus if p.suffix == ".png"]
+    for path in pngs:
+        shutil.copy2(path, illustration_dir / path.name)
+    generate_out_json(resource_root / "out.json", songs, [p.name for p in pngs], seed)
+    shutil.copy2(Path(conv.__file__), tree / "convert_milthm_assets.py")
+
+    started = time.perf_counter()
+    _, peak = run_measured([sys.executable, str(tree / "convert_milthm_assets.py"), "--full", *extra_args])
+    wall = time.perf_counter() - started
+    bytes_in = sum(p.stat().st_size for p in pngs)
+    return {
+        "name": f"main/full/songs{songs}" + ("/" + "_".join(a.lstrip("-") for a in extra_args) if extra_args else ""),
+        "images": len(pngs),
+        "wall_seconds": round(wall, 6),
+        "images_per_sec": round(len(pngs) / wall, 4) if wall > 0 else 0.0,
+        "mb_per_sec": round(bytes_in / 1024 / 1024 / wall, 4) if wall > 0 else 0.0,
+        "peak_rss_kb": peak,
+    }
+
+
+def compare(results: list[dict], baseline: dict, tolerance: float) -> list[str]:
+    """与基线逐项对比：吞吐下降或耗时增加超过 tolerance 视为回归"""
+    previous = {item["name"]: item for item in baseline.get("results", [])}
+    regressions: list[str] = []
+    for item in results:
+        old = previous.get(item["name"])
+        if not old:
+            log(f"  [NEW]  {item['name']}")
+            continue
+        if "images_per_sec" in item:
+            old_value, new_value, higher_is_better = old["images_per_sec"], item["images_per_sec"], True
+        else:
+            old_value, new_value, higher_is_better = old["seconds"], item["seconds"], False
+        change = (new_value - old_value) / old_value if old_value else 0.0
+        regressed = change < -tolerance if higher_is_better else change > tolerance
+        tag = "[REGR]" if regressed else "[OK]  "
+        log(f"  {tag} {item['name']}: {old_value} -> {new_value} ({change * 100:+.1f}%)")
+        if regressed:
+            regressions.append(item["name"])
+    return regressions
+
+
+def split_list(value: str) -> list[str]:
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="convert_milthm_assets.py 的离线基准测试")
+    parser.add_argument("--images", type=int, default=24, help="合成插图数量（默认 24）")
+    parser.add_argument("--songs", type=int, default=5000, help="假 out.json 中的歌曲数量（默认 5000）")
+    parser.add_argument("--executors", type=split_list, default=["process", "thread"], help="逗号分隔，默认 process,thread")
+    parser.add_argument("--workers", type=split_list, default=None, help="逗号分隔的 worker 数（默认 1 与 CPU 数）")
+    parser.add_argument("--formats", type=split_list, default=["WEBP"], help="逗号分隔，WEBP/AVIF（默认 WEBP）")
+    parser.add_argument("--qualities", type=split_list, default=[str(conv.COVER_QUALITY)], help="逗号分隔的质量")
+    parser.add_argument("--repeat", type=int, default=3, help="parse_out_json 重复次数（取最短）")
+    parser.add_argument("--main", action="store_true", help="额外以子进程运行一次完整的 main() 构建")
+    parser.add_argument("--seed", type=int, default=20240101, help="语料随机种子")
+    parser.add_argument("--output", type=Path, default=None, help="结果 JSON 输出路径（默认打印到 stdout）")
+    parser.add_argument("--baseline", type=Path, default=None, help=f"与基线对比（例如 {DEFAULT_BASELINE.relative_to(PROJECT_ROOT)}）")
+    parser.add_argument("--save-baseline", type=Path, default=None, help="把本次结果保存为基线")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="回归阈值（相对变化，默认 0.15）")
+    parser.add_argument("--workdir", type=Path, default=None, help="语料与输出目录（默认临时目录，结束后删除）")
+    # measure_convert 启动的子进程：运行一项转换配置，结果 JSON 写到 stdout
+    parser.add_argument("--measure-convert", default=None, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(argv)
+    if args.measure_convert:
+        spec = json.loads(args.measure_convert)
+        corpus = sorted(Path(spec["corpus"]).glob("illust_*"))
+        item = bench_convert(
+            corpus, Path(spec["output"]), spec["executor"], spec["workers"], spec["format"], spec["quality"]
+        )
+        print(json.dumps(item, ensure_ascii=False))
+        return 0
+    cpu = os.cpu_count() or 1
+    worker_counts = sorted({int(w) for w in args.workers} if args.workers else {1, cpu})
+
+    workdir = args.workdir or Path(tempfile.mkdtemp(prefix="milthm-bench-"))
+    try:
+        log(f"[*] 生成合成语料: {args.images} 张插图, {args.songs} 首歌曲 -> {workdir}")
+        corpus = generate_corpus(workdir / "corpus", args.images, args.seed)
+        out_json_path = workdir / "out.json"
+        generate_out_json(out_json_path, args.songs, [p.name for p in corpus], args.seed)
+
+        results: list[dict] = [bench_parse(out_json_path, args.songs, args.repeat)]
+        log(f"  {results[-1]['name']}: {results[-1]['seconds']}s")
+        for item in bench_flatten(max(CORPUS_SIZES, key=lambda size: size[0] * size[1]), args.repeat, args.seed):
+            results.append(item)
+            log(f"  {item['name']}: {item['seconds']}s, 每次新分配 {item['images_allocated']} 张图像")
+        for executor_kind in args.executors:
+            for workers in worker_counts:
+                for fmt in args.formats:
+                    for quality in args.qualities:
+                        item = measure_convert(
+                            workdir / "corpus", workdir / "output", executor_kind, workers, fmt.upper(), int(quality)
+                        )
+                        results.append(item)
+                        log(
+                            f"  {item['name']}: {item['images_per_sec']} 张/秒, "
+                            f"{item['mb_per_sec']} MB/秒, RSS 峰值 {item['peak_rss_kb'] / 1024:.1f}MB"
+                        )
+        if args.main:
+            results.append(bench_main(corpus, args.songs, workdir, [], args.seed))
+            log(f"  {results[-1]['name']}: {results[-1]['wall_seconds']}s")
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "version": BENCH_VERSION,
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": {
+            "python": platform.python_version(),
+            "pillow": Image.__version__,
+            "platform": platform.platform(),
+            "cpu_count": cpu,
+        },
+        "config": {
+            "images": args.images,
+            "songs": args.songs,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+    if args.save_baseline:
+        args.save_baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.save_baseline.write_text(text + "\n", encoding="utf-8")
+        log(f"[J] 基线已保存: {args.save_baseline}")
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        if baseline.get("config") != report["config"]:
+            log("[W]  基线的语料配置与本次不同，对比结果仅供参考")
+        log(f"\n[S] 与基线对比（阈值 {args.tolerance * 100:.0f}%）:")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            log(f"[FAIL] 发现 {len(regressions)} 项性能回归")
+            return 1
+        log("[OK] 未发现性能回归")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,12 +2,23 @@
 """
 转换 MilResource 的插图资源文件
 将 PNG 插图转换为 AVIF 格式并复制到 assets 目录
-同时生成 cover-map.json（歌名 → avif 文件名的映射）
+同时生成 cover-map.json（歌名 → avif 文件名的映射）与统一封面索引 cover-index.json
+默认根据 .build/build-manifest.json 增量构建，--full 强制全部重新转换
 """
 
+import argparse
+import base64
+import hashlib
+import heapq
+import io
 import json
+import math
+import mmap
+import os
 import re
 import shutil
+import signal
+import struct
 import sys
 
 # 强制 stdout/stderr 使用 UTF-8，避免 Windows GBK 编码问题
@@ -16,16 +27,156 @@ if sys.stdout.encoding != 'utf-8':
 if sys.stderr.encoding != 'utf-8':
     sys.stderr.reconfigure(encoding='utf-8', errors='replace')  # type: ignore
 import threading
+import time
 import unicodedata
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
 from pathlib import Path
 from urllib.parse import unquote
-from PIL import Image
+from PIL import Image, ImageColor, ImageMath, ImageOps, features
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
 
 # 项目根目录
 PROJECT_ROOT = Path(__file__).parent
 MIL_RESOURCE_ROOT = PROJECT_ROOT / "third_party" / "MilResource" / "resource"
 TARGET_ASSETS = PROJECT_ROOT / "assets"
+# 构建自身的状态（构建清单等）放在 assets 之外，不会随 assets 被 rolldown 复制到 lib/ 打进 npm 包
+BUILD_STATE_DIR = PROJECT_ROOT / ".build"
+MANIFEST_PATH = BUILD_STATE_DIR / "build-manifest.json"
+BUILD_REPORT_PATH = BUILD_STATE_DIR / "build-report.json"
+# 跨检出目录共享的转换缓存（--cache-dir），键为源文件内容 + 编码参数 + 编码器版本
+DEFAULT_CACHE_DIR = Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache") / "milthm-assets"
+DEFAULT_CACHE_SIZE_MB = 2048
+# 解码像素缓存（--pixel-cache）：模式处理后的像素，RAW_RGBA_HEADER 格式，按源文件哈希存放
+DEFAULT_PIXEL_CACHE_DIR = DEFAULT_CACHE_DIR / "pixels"
+DEFAULT_PIXEL_CACHE_SIZE_MB = 4096
+# 只追加的任务日志：构建中断后 --resume 据此跳过已完成的输出，构建成功后删除
+JOURNAL_PATH = BUILD_STATE_DIR / "build-journal.jsonl"
+# 分片构建（--shard K/N）时各分片的部分构建清单与 cover-map.json，由 merge 子命令合并后删除
+SHARDS_DIR = BUILD_STATE_DIR / "shards"
+
+# 需要提交到 git 的目录，构建时不会被清理
+PRESERVE_DIRS = {"backgrounds", "icons", "fonts", "badges"}
+
+# 转换逻辑版本：修改 convert_outputs 的输出语义时递增，使增量构建全部失效
+PIPELINE_VERSION = 3
+MANIFEST_VERSION = 1
+
+# 封面原图的编码质量
+COVER_QUALITY = 65
+# 卡片封面尺寸（与 image.ts COVER_W × COVER_H 保持一致）及预缩放倍率
+COVER_SIZE = (204, 115)
+COVER_SCALES = (1, 2)
+# 小尺寸变体细节少、体积小，使用稍高的质量
+COVER_VARIANT_QUALITY = 80
+
+# 占位图层：最小的卡片变体附带一张极小的缩略图与平均色，汇总到 covers/placeholders.json
+PLACEHOLDER_SIZE = (32, 18)
+PLACEHOLDER_QUALITY = 50
+
+# 缩放变体：先按整数倍 reduce 盒式缩小，保留至少 RESIZE_REDUCING_GAP 倍目标尺寸，再用 LANCZOS 得到最终尺寸
+RESIZE_REDUCING_GAP = 3.0
+# Image.reduce 能直接处理的模式（P 等调色板模式需先转换）
+REDUCIBLE_MODES = ("RGB", "RGBA", "L", "LA")
+
+# 非 PNG 源带 alpha 时拍平所用的底色（--matte）
+DEFAULT_MATTE = (255, 255, 255)
+
+# --target-ssim：按图二分搜索质量，在渲染尺寸（2x 卡片）下比较 SSIM，搜索范围为 [low, high]
+SSIM_DISPLAY_SIZE = (COVER_SIZE[0] * max(COVER_SCALES), COVER_SIZE[1] * max(COVER_SCALES))
+SSIM_QUALITY_RANGE = (30, 95)
+SSIM_BLOCK = 8
+
+# 除 quality 外的编码器选项（同时是转换缓存键的一部分）
+ENCODER_OPTIONS: dict[str, dict] = {
+    "WEBP": {"method": 6},
+    "AVIF": {"autotiling": False},
+}
+
+# 运行时层：预解码提交目录中的图片，image.ts 可跳过 wasm-vips 的 AVIF 解码
+RUNTIME_TIER_DIRS = ("icons", "backgrounds", "badges")
+RUNTIME_TIER_SOURCE_SUFFIXES = {".avif", ".webp", ".png"}
+# 原始 RGBA 文件头：magic(4s) version(u16) channels(u16) width(u32) height(u32)，小端
+RAW_RGBA_MAGIC = b"MRGB"
+RAW_RGBA_HEADER = struct.Struct("<4sHHII")
+# --runtime-tier auto：逐个资源编码候选格式，取 字节数 + λ × 本地解码毫秒数 最小者
+AUTO_FORMATS = ("AVIF", "WEBP", "PNG", "PNG8")
+AUTO_EXTENSIONS = {"AVIF": ".avif", "WEBP": ".webp", "PNG": ".png", "PNG8": ".png"}
+AUTO_QUALITY = {"AVIF": 80, "WEBP": 90}
+# λ：每毫秒解码时间折算的字节数。图标、徽章每次渲染都要加载，更看重解码速度；背景体积大、用得少，更看重体积
+AUTO_LAMBDA = {"icons": 20000.0, "badges": 20000.0, "backgrounds": 2000.0}
+AUTO_DECODE_RUNS = 3
+# 有损候选（AVIF/WebP/PNG8）解码后与源图逐通道（含 alpha）的 SSIM 下限，低于此值不参与选择；无损 PNG 总是可选
+AUTO_LOSSLESS_FORMATS = {"PNG"}
+AUTO_SSIM_FLOOR = 0.99
+# worker 编码出的合格候选暂存于此，全部转换结束后由主进程逐个测量解码耗时、选出输出后删除
+AUTO_CANDIDATES_DIR = BUILD_STATE_DIR / "auto-candidates"
+# 源资源相对路径（如 icons/0.avif）→ 选中的运行时文件与格式，供 image.ts 读取
+RUNTIME_INDEX_PATH = TARGET_ASSETS / "runtime" / "index.json"
+
+# 字体子集化：字形集 = out.json 中的全部歌名 + UI 文本文件中的字符 + 可打印 ASCII
+FONTS_DIR = TARGET_ASSETS / "fonts"
+FONT_SOURCE_SUFFIXES = {".ttf", ".otf"}
+FONT_SUBSET_SUFFIX = ".subset"
+# 子集只含歌名与 UI 文本中的字形，渲染器在它之后还会加载完整字体作为回退；
+# 子集改用独立的字体族名，避免与完整字体同名而被当作同一字体、回退不生效
+FONT_SUBSET_FAMILY_SUFFIX = " Subset"
+DEFAULT_FONT_TEXT_FILES = (PROJECT_ROOT / "src" / "renderer" / "image.ts",)
+# 子集化报告只供构建使用，写在构建状态目录中
+FONT_SUBSET_REPORT_PATH = BUILD_STATE_DIR / "font-subset-report.json"
+
+# 可变字体实例化：按配置的轴坐标生成静态实例并移除变体表
+# 键为相对 FONTS_DIR 的路径；默认固定在渲染时实际使用的默认坐标
+FONT_INSTANCE_SUFFIX = ".instance-"
+FONT_INSTANCES: dict[str, tuple[dict[str, float], ...]] = {
+    "alimamafangyuanti/AlimamaFangYuanTiVF-Thin.ttf": ({"wght": 700, "BEVL": 100},),
+}
+# 实例化后仍可能残留的变体相关表
+FONT_VARIATION_TABLES = ("fvar", "gvar", "avar", "cvar", "HVAR", "VVAR", "MVAR", "STAT")
+
+# 调度代价模型（没有历史构建报告时使用的默认值）
+DEFAULT_SECONDS_PER_MPX = 0.15
+DEFAULT_SECONDS_PER_FONT_MB = 0.5
+# 预缩放变体只编码小图，代价按全尺寸转换的比例估计
+VARIANT_COST_FACTOR = 0.4
+
+# 内存准入：每个任务的解码占用估算 = 像素数 × 4 字节 × 系数（原图 + 模式转换副本 + 编码器缓冲）
+IMAGE_MEMORY_FACTOR = 3
+# fontTools 展开后的对象远大于字体文件本身
+FONT_MEMORY_FACTOR = 30
+# 未指定 --memory-budget 时使用可用内存（cgroup 限制或物理内存）的比例
+DEFAULT_MEMORY_BUDGET_FRACTION = 0.6
+
+# 图标图集：image.ts 每次渲染都会加载的图标打包为一张图 + 坐标索引
+ATLAS_SOURCE_SUFFIXES = {".avif", ".webp", ".png"}
+# 入选的图标（文件名 stem）及其缩放上限：段位/评级图标（getLevelIconName）显示为 GRADE_ICON_W × GRADE_ICON_W，
+# 星标（{n}-star）宽 starImgW，都按 2 倍显示尺寸保存。头像、按钮背景等其余图片不进图集
+ATLAS_ICON_BOXES = (
+    (re.compile(r"-?\d+"), (80, 80)),
+    (re.compile(r"\d+-star"), (160, 80)),
+)
+ATLAS_MAX_WIDTH = 4096
+# 图标之间的透明间隔，避免缩放采样时相邻图标互相渗色
+ATLAS_PADDING = 2
+
+# 资源包（pack）：运行时读取的全部已编码图片拼接为一个对齐的 blob + 偏移索引，运行时只需打开一个文件
+PACK_DIR = TARGET_ASSETS / "pack"
+PACK_BLOB_PATH = PACK_DIR / "assets.bin"
+PACK_INDEX_PATH = PACK_DIR / "index.json"
+PACK_FORMATS = {".avif": "AVIF", ".webp": "WEBP", ".png": "PNG"}
+# 每个条目按页对齐：可以单独映射
+PACK_ALIGNMENT = 4096
+PACK_VERSION = 1
+
+# 版本化发布（--publish DIR）：DIR/versions/<版本号>/ 为完整的资产快照（硬链接自工作目录），
+# DIR/current 为指向当前版本的符号链接，原子切换；除当前版本外保留最近 N 个版本用于回滚
+DEFAULT_KEEP_VERSIONS = 3
+# yarn build 先 rimraf lib 再把 assets 复制进去，发布目录放在其中会被整个删掉
+BUILD_OUTPUT_DIR = PROJECT_ROOT / "lib"
 
 # 线程安全锁（用于 print）
 _print_lock = threading.Lock()
@@ -51,16 +202,21 @@ def sanitize_filename(name: str) -> str:
     return name.strip()
 
 
-def parse_out_json(out_json_path: Path) -> dict[str, str]:
-    """
-    解析 out.json，返回 { song_title: png_filename } 映射。
-    同时收录 SharingMetaData.Title 和所有 Level.MetaData.Title，
-    确保 constant.js 里的任何歌名变体都能找到对应封面。
-    """
+@dataclass
+class SongEntry:
+    """out.json 中的一首歌：插图文件名、全部歌名变体与谱面 BeatmapId"""
+
+    png_filename: str
+    titles: list[str]
+    beatmap_ids: list[str]
+
+
+def parse_songs(out_json_path: Path) -> list[SongEntry]:
+    """解析 out.json，按出现顺序返回所有带插图的歌曲"""
     with open(out_json_path, encoding="utf-8") as f:
         chapters = json.load(f)
 
-    title_to_png: dict[str, str] = {}
+    songs: list[SongEntry] = []
 
     for chapter in (chapters if isinstance(chapters, list) else chapters.values()):
         for song in chapter.get("Songs", []):
@@ -73,91 +229,2543 @@ def parse_out_json(out_json_path: Path) -> dict[str, str]:
             decoded = unquote(raw_filename)
             png_filename = re.sub(r"\.milimg$", ".png", decoded, flags=re.IGNORECASE)
 
+            entry = SongEntry(png_filename, [], [])
+
             # 收录 SharingMetaData.Title
             sharing_title: str = sharing.get("Title", "")
-            if sharing_title and sharing_title not in title_to_png:
-                title_to_png[sharing_title] = png_filename
+            if sharing_title:
+                entry.titles.append(sharing_title)
 
-            # 收录所有 Level.MetaData.Title（可能与 SharingMetaData.Title 不同）
+            # 收录所有 Level.MetaData.Title（可能与 SharingMetaData.Title 不同）及 BeatmapId
             for level in song.get("Levels", []):
                 level_title: str = level.get("MetaData", {}).get("Title", "")
-                if level_title and level_title not in title_to_png:
-                    title_to_png[level_title] = png_filename
+                if level_title:
+                    entry.titles.append(level_title)
+                beatmap_id: str = (level.get("BeatmapId") or "").strip()
+                if beatmap_id:
+                    entry.beatmap_ids.append(beatmap_id)
 
+            songs.append(entry)
+
+    return songs
+
+
+def parse_out_json(out_json_path: Path) -> dict[str, str]:
+    """
+    解析 out.json，返回 { song_title: png_filename } 映射。
+    同时收录 SharingMetaData.Title 和所有 Level.MetaData.Title，
+    确保 constant.js 里的任何歌名变体都能找到对应封面。
+    """
+    return map_titles_to_png(parse_songs(out_json_path))
+
+
+def map_titles_to_png(songs: list[SongEntry]) -> dict[str, str]:
+    """{ song_title: png_filename }，同名以最先出现者为准"""
+    title_to_png: dict[str, str] = {}
+    for song in songs:
+        for title in song.titles:
+            if title not in title_to_png:
+                title_to_png[title] = song.png_filename
     return title_to_png
 
 
-def convert_image(source_path: Path, target_path: Path, quality: int = 85, fmt: str = "AVIF"):
+def normalize_title(title: str) -> str:
+    """封面索引中的歌名键：NFC 规范化并合并空白（与 image.ts normalizeTitle 保持一致）"""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", title)).strip()
+
+
+def file_sha256(path: Path) -> str:
+    """计算文件内容的 sha256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def encoder_version(fmt: str) -> str:
+    """编码器版本标识：转换逻辑版本 + Pillow 版本 + 编解码库版本"""
+    if fmt in ("SUBSET", "INSTANCE"):
+        return f"pipeline{PIPELINE_VERSION}/fonttools-{fonttools_version()}"
+    if fmt == "AUTO":
+        codecs = "/".join(f"{name}-{features.version(name) or 'unknown'}" for name in ("avif", "webp", "zlib"))
+        return f"pipeline{PIPELINE_VERSION}/pillow-{Image.__version__}/auto-{codecs}"
+    feature = {"WEBP": "webp", "AVIF": "avif", "PNG": "zlib"}.get(fmt)
+    codec = features.version(feature) if feature else "raw"
+    return f"pipeline{PIPELINE_VERSION}/pillow-{Image.__version__}/{fmt.lower()}-{codec or 'unknown'}"
+
+
+def fonttools_version() -> str:
+    """fontTools 为可选依赖，未安装时返回 unknown"""
+    try:
+        import fontTools
+
+        return fontTools.version
+    except ImportError:
+        return "unknown"
+
+
+def load_manifest(path: Path, section: str = "outputs") -> dict[str, dict]:
     """
-    转换图片文件到目标格式（AVIF 或 WebP）
-    PNG 文件保留 alpha 通道，JPG 文件转为 RGB
+    读取构建清单的一个分区；版本不符或损坏时视为空
+      outputs: { 输出相对路径: 记录 }
+      fingerprints: { 源文件路径: 像素指纹 }
     """
     try:
-        with Image.open(source_path) as img:
-            target_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(data, dict) or data.get("version") != MANIFEST_VERSION:
+        return {}
+    entries = data.get(section)
+    return entries if isinstance(entries, dict) else {}
+
+
+def save_manifest(path: Path, outputs: dict[str, dict], fingerprints: dict[str, dict] | None = None):
+    """写入构建清单（先写临时文件再替换，避免中断时留下半个 JSON）"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    data: dict = {"version": MANIFEST_VERSION, "outputs": dict(sorted(outputs.items()))}
+    if fingerprints:
+        data["fingerprints"] = dict(sorted(fingerprints.items()))
+    write_json(path, data, ensure_ascii=False, indent=2)
+
+
+def load_journal(path: Path) -> dict[str, dict]:
+    """读取上次中断的构建留下的任务日志 { 输出相对路径: 清单记录 }；被中断截断的末行直接忽略"""
+    entries: dict[str, dict] = {}
+    try:
+        f = open(path, encoding="utf-8")
+    except OSError:
+        return entries
+    with f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if (
+                isinstance(record, dict)
+                and record.get("version") == MANIFEST_VERSION
+                and isinstance(record.get("key"), str)
+                and isinstance(record.get("entry"), dict)
+            ):
+                entries[record["key"]] = record["entry"]
+    return entries
+
+
+class BuildJournal:
+    """
+    只追加的任务日志，每完成一个输出写入一行清单记录。
+    每行写入后立即 flush，进程被 OOM kill 或超时杀掉时已完成的记录也不会丢失。
+    """
+
+    def __init__(self, path: Path, resume: bool):
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(path, "a" if resume else "w", encoding="utf-8")
+
+    def record(self, key: str, entry: dict):
+        line = json.dumps({"version": MANIFEST_VERSION, "key": key, "entry": entry}, ensure_ascii=False)
+        self.file.write(line + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def discard(self):
+        """构建成功、构建清单已写入后删除日志"""
+        self.close()
+        self.path.unlink(missing_ok=True)
+
+
+def manifest_key(target_path: Path) -> str:
+    """清单中使用相对于 TARGET_ASSETS 的 POSIX 路径作为键"""
+    return target_path.relative_to(TARGET_ASSETS).as_posix()
+
+
+def source_key(source_path: Path) -> str:
+    """源文件路径尽量记录为相对 PROJECT_ROOT 的 POSIX 路径，使清单可在不同检出目录间复用"""
+    try:
+        return source_path.relative_to(PROJECT_ROOT).as_posix()
+    except ValueError:
+        return source_path.as_posix()
+
+
+def is_up_to_date(
+    entry: dict | None,
+    source_path: Path,
+    target_path: Path,
+    quality: int,
+    fmt: str,
+    size: tuple[int, int] | None = None,
+    options: dict | None = None,
+) -> bool:
+    """
+    判断输出是否仍然有效。
+    参数、编码器版本与输出文件都一致时，先比较源文件 size/mtime，
+    不一致再回退到内容哈希（例如 git checkout 只改变了 mtime）。
+    命中哈希时会原地刷新记录中的 mtime，下次直接走快速路径。
+    """
+    if not entry:
+        return False
+    if (
+        entry.get("source") != source_key(source_path)
+        or entry.get("quality") != quality
+        or entry.get("format") != fmt
+        or entry.get("size") != (list(size) if size else None)
+        or entry.get("options") != options
+        or entry.get("encoder") != encoder_version(fmt)
+    ):
+        return False
+    try:
+        source_stat = source_path.stat()
+        target_stat = target_path.stat()
+    except OSError:
+        return False
+    if target_stat.st_size != entry.get("output_size"):
+        return False
+    if source_stat.st_size != entry.get("source_size"):
+        return False
+    if source_stat.st_mtime_ns == entry.get("source_mtime_ns"):
+        return True
+    if file_sha256(source_path) != entry.get("source_hash"):
+        return False
+    entry["source_mtime_ns"] = source_stat.st_mtime_ns
+    return True
+
+
+def remove_orphans(keep: set[Path]) -> int:
+    """
+    删除 TARGET_ASSETS 中不属于本次构建、也不在保留目录中的文件，返回删除数量。
+    保留目录中由构建生成的字体（子集、实例）同样按本次构建的输出清理
+    """
+    removed = 0
+    if not TARGET_ASSETS.exists():
+        return removed
+    for item in sorted(TARGET_ASSETS.iterdir()):
+        if item.name in PRESERVE_DIRS and item.is_dir():
+            for path in sorted(item.rglob("*")):
+                if path.is_file() and path not in keep and is_generated_font(path):
+                    path.unlink()
+                    removed += 1
+            continue
+        if item in keep:
+            continue
+        if item.is_dir():
+            for path in sorted(item.rglob("*"), reverse=True):
+                if path.is_dir():
+                    if not any(path.iterdir()):
+                        path.rmdir()
+                elif path not in keep:
+                    path.unlink()
+                    removed += 1
+            if not any(item.iterdir()):
+                item.rmdir()
+        else:
+            item.unlink()
+            removed += 1
+    return removed
+
+
+def lap(timings: dict[str, float], stage: str, started: float) -> float:
+    """记录从 started 到现在的阶段耗时（同名阶段累加），返回当前时间作为下一阶段的起点"""
+    now = time.perf_counter()
+    timings[stage] = timings.get(stage, 0.0) + now - started
+    return now
+
+
+def max_rss_kb() -> int:
+    """当前进程的 RSS 峰值（KB）；Windows 上不可用时返回 0"""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 以字节为单位，Linux 以 KB 为单位
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+@dataclass
+class TaskResult:
+    """单个转换/复制任务的结果（由 worker 返回，主进程负责输出）"""
+
+    kind: str  # "image" | "copy"
+    source: str
+    target: str
+    ok: bool
+    source_bytes: int = 0
+    target_bytes: int = 0
+    has_alpha: bool = False
+    # PNG 源的 alpha 处理："kept" 按 RGBA 编码，"dropped" alpha 全不透明（或没有 alpha）按 RGB 编码
+    alpha: str = ""
+    fmt: str = ""
+    quality: int = 0
+    width: int = 0
+    height: int = 0
+    # 各阶段的附加信息（例如字体子集化的字形数）
+    extra: dict = field(default_factory=dict)
+    # 各阶段耗时（秒）与这个任务同时存活的像素缓冲区峰值（估算）
+    timings: dict[str, float] = field(default_factory=dict)
+    peak_bytes: int = 0
+    # 执行任务的 worker 进程号与该进程到任务结束时的 RSS 峰值：
+    # RSS 峰值是整个进程生命周期（线程执行器下是整个构建进程）的最高值，不能当作这个任务的内存占用
+    worker: int = 0
+    worker_rss_kb: int = 0
+    # 输出直接取自转换缓存
+    cached: bool = False
+    source_hash: str = ""
+    output_hash: str = ""
+    error: str = ""
+
+
+def record_worker(result: TaskResult):
+    """在 worker 中记录执行任务的进程与它当前的 RSS 峰值（由 build_report 按 worker 汇总）"""
+    result.worker = os.getpid()
+    result.worker_rss_kb = max_rss_kb()
+
+
+# 拍平用的底图缓冲区，每个 worker（线程）一份
+_flatten_buffers = threading.local()
+
+
+def flatten_alpha(img: Image.Image, matte: tuple[int, int, int] = DEFAULT_MATTE) -> Image.Image:
+    """
+    把 RGBA/LA 图像按 alpha 合成到纯色底上，得到 RGB。
+    paste 直接以源图自身的 alpha 通道为蒙版一次混合（RGBA/LA 贴到 RGB 上不做中间转换，也不 split），
+    底图缓冲区按 worker 复用，尺寸相同时只原地填充底色，不再分配整幅图像。
+    返回的图像会在同一 worker 下一次拍平时被覆盖，只能在当前任务内使用
+    """
+    buffer = getattr(_flatten_buffers, "image", None)
+    if buffer is None or buffer.size != img.size:
+        buffer = _flatten_buffers.image = Image.new("RGB", img.size, matte)
+    else:
+        buffer.paste(matte, (0, 0, *img.size))
+    buffer.paste(img, (0, 0), img)
+    return buffer
+
+
+def parse_matte(value: str) -> tuple[int, int, int]:
+    """解析 --matte：CSS 颜色（#ffffff、white）或 r,g,b"""
+    try:
+        if "," in value:
+            r, g, b = (int(part) for part in value.split(","))
+            if all(0 <= channel <= 255 for channel in (r, g, b)):
+                return r, g, b
+            raise ValueError(value)
+        return ImageColor.getrgb(value)[:3]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"无法识别的颜色: {value!r}")
+
+
+def normalize_mode(img: Image.Image, is_png: bool, matte: tuple[int, int, int] = DEFAULT_MATTE) -> Image.Image:
+    """PNG 统一为 RGBA 保留 alpha；其他格式拍平到 matte 底色的 RGB"""
+    if is_png:
+        if img.mode not in ("RGBA",):
+            img = img.convert("RGBA")
+    else:
+        if img.mode in ("RGBA", "LA"):
+            img = flatten_alpha(img, matte)
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+    return img
+
+
+def cache_key(
+    source_hash: str,
+    fmt: str,
+    quality: int,
+    size: tuple[int, int] | None,
+    target_ssim: float | None = None,
+    matte: tuple[int, int, int] = DEFAULT_MATTE,
+) -> str:
+    """转换缓存键：源文件哈希 + 格式、质量（或 SSIM 目标）、尺寸、底色、编码器选项与版本，任一变化都会得到新的键"""
+    payload = {
+        "source": source_hash,
+        "format": fmt,
+        "quality": quality,
+        "target_ssim": target_ssim,
+        "matte": list(matte),
+        "size": list(size) if size else None,
+        "options": ENCODER_OPTIONS.get(fmt, {}),
+        "encoder": encoder_version(fmt),
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def cache_object_path(cache_dir: Path, key: str, fmt: str) -> Path:
+    return cache_dir / "objects" / key[:2] / f"{key}.{fmt.lower()}"
+
+
+def cache_sidecar_path(object_path: Path) -> Path:
+    """缓存对象旁记录编码结果附加信息（SSIM 搜索选中的质量与得分）的文件，命中时恢复到 result.extra"""
+    return object_path.with_name(object_path.name + ".json")
+
+
+def temporary_path(path: Path) -> Path:
+    """同目录下的临时文件名（进程号 + 线程号，多个 worker 同时写也不会冲突）"""
+    return path.with_name(f".{path.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+
+
+def write_output(target_path: Path, data: bytes):
+    """
+    先写临时文件再替换。
+    输出可能是转换缓存对象的硬链接，原地覆盖写会同时改坏缓存中的文件
+    """
+    target_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = temporary_path(target_path)
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, target_path)
+
+
+def write_json(target_path: Path, data, **dump_options):
+    """
+    JSON 输出同样先写临时文件再替换：读取方不会看到半个文件，已发布版本中的硬链接也不会被改写。
+    内容不变时不写，保持原文件（发布时据此判断资产是否变化）
+    """
+    encoded = json.dumps(data, **dump_options).encode("utf-8")
+    try:
+        if target_path.read_bytes() == encoded:
+            return
+    except OSError:
+        pass
+    write_output(target_path, encoded)
+
+
+def link_file(source_path: Path, target_path: Path):
+    """硬链接（同一文件系统时不复制数据），失败时退回复制；通过临时文件替换，目标已存在也可覆盖"""
+    target_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = temporary_path(target_path)
+    try:
+        os.link(source_path, tmp_path)
+    except OSError:
+        shutil.copyfile(source_path, tmp_path)
+    os.replace(tmp_path, target_path)
+
+
+def evict_cache(directory: Path, max_bytes: int) -> tuple[int, int]:
+    """
+    按最近使用时间（命中时会刷新 mtime）淘汰缓存目录中的文件，直到总大小不超过 max_bytes。
+    返回 (剩余字节数, 淘汰数量)
+    """
+    objects: list[tuple[int, int, Path]] = []
+    for path in directory.rglob("*"):
+        # 附加信息文件随所属对象一起淘汰
+        if path.name.startswith(".") or path.suffix == ".json":
+            continue
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        if path.is_file():
+            size = stat.st_size
+            try:
+                size += cache_sidecar_path(path).stat().st_size
+            except OSError:
+                pass
+            objects.append((stat.st_mtime_ns, size, path))
+
+    total = sum(size for _, size, _ in objects)
+    evicted = 0
+    for _, size, path in sorted(objects):
+        if total <= max_bytes:
+            break
+        try:
+            path.unlink()
+            cache_sidecar_path(path).unlink(missing_ok=True)
+        except OSError:
+            continue
+        total -= size
+        evicted += 1
+    return total, evicted
+
+
+def pixel_cache_path(pixel_cache_dir: Path, source_hash: str, matte: tuple[int, int, int] = DEFAULT_MATTE) -> Path:
+    """像素与模式处理逻辑及拍平底色相关，键中带上 PIPELINE_VERSION 与非默认底色"""
+    matte_tag = "" if matte == DEFAULT_MATTE else "-{:02x}{:02x}{:02x}".format(*matte)
+    return pixel_cache_dir / source_hash[:2] / f"{source_hash}.p{PIPELINE_VERSION}{matte_tag}.raw"
+
+
+def read_pixel_cache(path: Path) -> Image.Image | None:
+    """
+    以内存映射方式读取缓存的像素。RGBA 图像直接引用映射的页面（零拷贝），
+    图像的最后一个引用释放时自动解除映射；文件损坏时返回 None
+    """
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(mapped) < RAW_RGBA_HEADER.size:
+        mapped.close()
+        return None
+    magic, version, channels, width, height = RAW_RGBA_HEADER.unpack_from(mapped)
+    if (
+        magic != RAW_RGBA_MAGIC
+        or version != 1
+        or channels not in (3, 4)
+        or len(mapped) != RAW_RGBA_HEADER.size + width * height * channels
+    ):
+        mapped.close()
+        return None
+    mode = "RGBA" if channels == 4 else "RGB"
+    # Pillow 只能直接映射 RGBA 等 4 字节像素，RGB 会在这里复制一份（仍省去了 PNG 解压）
+    return Image.frombuffer(mode, (width, height), memoryview(mapped)[RAW_RGBA_HEADER.size :], "raw", mode, 0, 1)
+
+
+def write_pixel_cache(path: Path, img: Image.Image):
+    """与运行时层的 RGBA 文件相同的格式：RAW_RGBA_HEADER + 逐行像素"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = temporary_path(path)
+    with open(tmp_path, "wb") as f:
+        f.write(RAW_RGBA_HEADER.pack(RAW_RGBA_MAGIC, 1, len(img.getbands()), img.width, img.height))
+        f.write(img.tobytes())
+    os.replace(tmp_path, path)
+
+
+def drop_opaque_alpha(img: Image.Image) -> tuple[Image.Image, bool]:
+    """
+    RGBA 图像的 alpha 全为 255 时转为 RGB，返回 (图像, 是否保留 alpha)。
+    getextrema 在 C 中一次扫描求出各通道最值，不会复制 alpha 通道
+    """
+    if img.mode != "RGBA":
+        return img, False
+    if img.getextrema()[3][0] < 255:
+        return img, True
+    return img.convert("RGB"), False
+
+
+def image_bytes(img: Image.Image) -> int:
+    """解码后像素缓冲区的大小"""
+    return img.width * img.height * len(img.getbands())
+
+
+def encode_image(img: Image.Image, fmt: str, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    if fmt == "WEBP":
+        # WebP: 用于封面
+        img.save(buffer, "WEBP", quality=quality, **ENCODER_OPTIONS["WEBP"])
+    else:
+        # AVIF: 用于 icons/backgrounds（小文件，vips 能正常解码）
+        img.save(buffer, "AVIF", quality=quality, **ENCODER_OPTIONS["AVIF"])
+    return buffer.getvalue()
+
+
+def luma_at(img: Image.Image, size: tuple[int, int]) -> Image.Image:
+    """缩放到显示尺寸后的亮度通道（F 模式）"""
+    luma = img.convert("L")
+    if luma.size != size:
+        luma = ImageOps.fit(luma, size, method=Image.Resampling.LANCZOS, centering=(0.5, 0.5))
+    return luma.convert("F")
+
+
+def block_ssim(x: Image.Image, y: Image.Image, block: int = SSIM_BLOCK) -> float:
+    """
+    亮度通道的 SSIM，窗口为 block×block 的非重叠块。
+    窗口内均值、方差、协方差都用 BOX 缩放求得，只依赖 Pillow
+    """
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    grid = (max(1, x.width // block), max(1, x.height // block))
+
+    def mean(img: Image.Image) -> Image.Image:
+        return img.resize(grid, Image.Resampling.BOX)
+
+    mu_x, mu_y = mean(x), mean(y)
+    xx = mean(ImageMath.lambda_eval(lambda a: a["x"] * a["x"], x=x))
+    yy = mean(ImageMath.lambda_eval(lambda a: a["y"] * a["y"], y=y))
+    xy = mean(ImageMath.lambda_eval(lambda a: a["x"] * a["y"], x=x, y=y))
+    ssim_map = ImageMath.lambda_eval(
+        lambda a: ((2 * a["mx"] * a["my"] + c1) * (2 * (a["xy"] - a["mx"] * a["my"]) + c2))
+        / (
+            (a["mx"] * a["mx"] + a["my"] * a["my"] + c1)
+            * (a["xx"] - a["mx"] * a["mx"] + a["yy"] - a["my"] * a["my"] + c2)
+        ),
+        mx=mu_x,
+        my=mu_y,
+        xx=xx,
+        yy=yy,
+        xy=xy,
+    )
+    return ssim_map.resize((1, 1), Image.Resampling.BOX).getpixel((0, 0))
+
+
+def search_quality(
+    img: Image.Image, fmt: str, target_ssim: float, display_size: tuple[int, int]
+) -> tuple[bytes, int, float]:
+    """
+    二分搜索满足 SSIM ≥ target_ssim 的最低质量，返回 (编码结果, 质量, SSIM)。
+    最高质量也达不到目标时使用最高质量
+    """
+    reference = luma_at(img, display_size)
 
-            is_png = source_path.suffix.lower() == ".png"
+    def evaluate(quality: int) -> tuple[bytes, int, float]:
+        encoded = encode_image(img, fmt, quality)
+        with Image.open(io.BytesIO(encoded)) as decoded:
+            return encoded, quality, block_ssim(reference, luma_at(decoded, display_size))
 
-            if fmt == "WEBP":
-                # WebP: 保留 alpha（RGBA）或转 RGB
+    low, high = SSIM_QUALITY_RANGE
+    best = None
+    while low <= high:
+        candidate = evaluate((low + high) // 2)
+        if candidate[2] >= target_ssim:
+            best = candidate
+            high = candidate[1] - 1
+        else:
+            low = candidate[1] + 1
+    return best or evaluate(SSIM_QUALITY_RANGE[1])
+
+
+def fit_box(source_size: tuple[int, int], size: tuple[int, int]) -> tuple[float, float, float, float]:
+    """与 ImageOps.fit(centering=(0.5, 0.5)) 相同的居中裁剪区域"""
+    width, height = source_size
+    target_ratio = size[0] / size[1]
+    if width / height > target_ratio:
+        crop_width, crop_height = height * target_ratio, float(height)
+    else:
+        crop_width, crop_height = float(width), width / target_ratio
+    left, top = (width - crop_width) / 2, (height - crop_height) / 2
+    return left, top, left + crop_width, top + crop_height
+
+
+def reduce_for(img: Image.Image, size: tuple[int, int]) -> Image.Image:
+    """按整数倍盒式缩小，裁剪区域仍保留至少 RESIZE_REDUCING_GAP 倍目标尺寸；倍数不足 2 或模式不支持时原样返回"""
+    if img.mode not in REDUCIBLE_MODES:
+        return img
+    left, top, right, bottom = fit_box(img.size, size)
+    factor = int(min((right - left) / size[0], (bottom - top) / size[1]) / RESIZE_REDUCING_GAP)
+    return img.reduce(factor) if factor >= 2 else img
+
+
+def fit_resize(img: Image.Image, size: tuple[int, int]) -> Image.Image:
+    """居中裁剪并缩放到 size：reduce 之后只对裁剪区域做一次 LANCZOS"""
+    img = reduce_for(img, size)
+    return img.resize(size, Image.Resampling.LANCZOS, box=fit_box(img.size, size))
+
+
+def make_placeholder(encoded: bytes) -> dict:
+    """
+    由已编码的卡片变体生成占位数据：PLACEHOLDER_SIZE 的 WebP（base64）与平均色。
+    从编码结果而不是编码前的像素生成，转换缓存命中时也能得到相同的结果
+    """
+    with Image.open(io.BytesIO(encoded)) as img:
+        tiny = fit_resize(img.convert("RGB"), PLACEHOLDER_SIZE)
+    color = tiny.resize((1, 1), Image.Resampling.BOX).getpixel((0, 0))
+    buffer = io.BytesIO()
+    tiny.save(buffer, "WEBP", quality=PLACEHOLDER_QUALITY, **ENCODER_OPTIONS["WEBP"])
+    return {
+        "color": "#{:02x}{:02x}{:02x}".format(*color),
+        "data": base64.b64encode(buffer.getvalue()).decode("ascii"),
+    }
+
+
+def decode_source(
+    data: bytes,
+    is_png: bool,
+    result: TaskResult,
+    started: float,
+    matte: tuple[int, int, int] = DEFAULT_MATTE,
+    size: tuple[int, int] | None = None,
+) -> tuple[Image.Image, float]:
+    """
+    解码源文件并完成模式处理（decode、reduce、mode 或 flatten 阶段），返回图像与下一阶段的起点。
+    指定 size 时按输出尺寸缩小解码：JPEG 用 draft() 让解码器直接按 1/2~1/8 解码，
+    其余格式解码后先 reduce 再做模式处理，后续各步的像素数与输出尺寸成正比
+    """
+    timings = result.timings
+    # 源数据在内存中，load() 之后不再需要文件对象；这里不能用 with，关闭会让返回的图像失效
+    img = Image.open(io.BytesIO(data))
+    if size is not None and img.format == "JPEG":
+        left, top, right, bottom = fit_box(img.size, size)
+        scale = RESIZE_REDUCING_GAP * max(size[0] / (right - left), size[1] / (bottom - top))
+        if scale < 1:
+            img.draft(img.mode, (math.ceil(img.width * scale), math.ceil(img.height * scale)))
+    img.load()
+    result.peak_bytes = image_bytes(img)
+    started = lap(timings, "decode", started)
+
+    if size is not None:
+        reduced = reduce_for(img, size)
+        if reduced is not img:
+            result.peak_bytes = max(result.peak_bytes, image_bytes(img) + image_bytes(reduced))
+            img = reduced
+            started = lap(timings, "reduce", started)
+
+    flatten = not is_png and img.mode in ("RGBA", "LA")
+    decoded = img
+    if is_png and "A" not in img.getbands() and "transparency" not in img.info:
+        # 没有 alpha 的 PNG 直接转 RGB，不必先扩成 RGBA 再去掉
+        img = img.convert("RGB") if img.mode != "RGB" else img
+        result.alpha = "dropped"
+    else:
+        img = normalize_mode(img, is_png, matte)
+        if is_png:
+            img, kept = drop_opaque_alpha(img)
+            result.alpha = "kept" if kept else "dropped"
+    result.has_alpha = result.alpha == "kept"
+    if img is not decoded:
+        result.peak_bytes = max(result.peak_bytes, image_bytes(decoded) + image_bytes(img))
+    started = lap(timings, "flatten" if flatten else "mode", started)
+    return img, started
+
+
+def convert_image(
+    source_path: Path,
+    target_path: Path,
+    quality: int = 85,
+    fmt: str = "AVIF",
+    size: tuple[int, int] | None = None,
+    cache_dir: Path | None = None,
+    pixel_cache_dir: Path | None = None,
+    target_ssim: float | None = None,
+    matte: tuple[int, int, int] = DEFAULT_MATTE,
+    placeholder: bool = False,
+) -> TaskResult:
+    """转换图片文件到目标格式（AVIF 或 WebP），只有一个输出的 convert_outputs"""
+    output = (target_path, quality, size, target_ssim, placeholder)
+    return convert_outputs(source_path, [output], fmt, cache_dir, pixel_cache_dir, matte)[0]
+
+
+def restore_cached_output(
+    result: TaskResult, cached_path: Path, target_path: Path, is_png: bool, placeholder: bool, started: float
+):
+    """转换缓存命中：链接缓存中的输出，由编码结果补全 result，跳过解码与编码"""
+    link_file(cached_path, target_path)
+    # 刷新 mtime 作为 LRU 的最近使用时间
+    os.utime(cached_path)
+    sidecar_path = cache_sidecar_path(cached_path)
+    if sidecar_path.exists():
+        with open(sidecar_path, encoding="utf-8") as f:
+            result.extra.update(json.load(f))
+    encoded = target_path.read_bytes()
+    with Image.open(io.BytesIO(encoded)) as cached:
+        result.width, result.height = cached.size
+        result.has_alpha = cached.mode == "RGBA"
+    if is_png:
+        result.alpha = "kept" if result.has_alpha else "dropped"
+    if placeholder:
+        result.extra["placeholder"] = make_placeholder(encoded)
+    lap(result.timings, "cache", started)
+    result.target_bytes = len(encoded)
+    result.output_hash = hashlib.sha256(encoded).hexdigest()
+    record_worker(result)
+    result.cached = True
+    result.ok = True
+
+
+def convert_outputs(
+    source_path: Path,
+    outputs: list[tuple],
+    fmt: str = "AVIF",
+    cache_dir: Path | None = None,
+    pixel_cache_dir: Path | None = None,
+    matte: tuple[int, int, int] = DEFAULT_MATTE,
+) -> list[TaskResult]:
+    """
+    把一张源图转换为一个或多个输出（全尺寸封面与各尺寸卡片变体），源文件只读取、解码一次。
+    outputs 为 (目标路径, 质量, 尺寸, SSIM 目标, 是否生成占位) 列表，按顺序各返回一个 TaskResult：
+    PNG 文件保留 alpha 通道，JPG 文件转为 RGB，非 PNG 源带 alpha 时拍平到 matte 底色
+    指定尺寸时按目标宽高比居中裁剪并缩放（封面变体）；全部输出都指定了尺寸时解码阶段就按最大的尺寸缩小（见 decode_source）
+    指定 cache_dir 时先查转换缓存，命中的输出直接链接缓存中的文件，全部命中时跳过解码
+    指定 pixel_cache_dir 时从像素缓存内存映射读取模式处理后的像素，未命中则解码后写入
+    指定 SSIM 目标时忽略质量，按渲染尺寸下的 SSIM 搜索质量，结果记录在 result.extra
+    生成占位时由输出生成占位缩略图与平均色，记录在 result.extra["placeholder"]
+
+    只接收路径与参数，不打印输出，便于在子进程中执行。
+    各阶段（read/decode/mode 或 flatten/pixels/resize/encode/write）耗时记录在 result.timings，
+    共用的读取与解码记在第一个需要解码的输出上；同时存活的像素缓冲区峰值记录在 result.peak_bytes。
+    """
+    is_png = source_path.suffix.lower() == ".png"
+    results = [
+        TaskResult("image", str(source_path), str(target), ok=False, has_alpha=is_png, fmt=fmt, quality=quality)
+        for target, quality, *_ in outputs
+    ]
+    try:
+        started = time.perf_counter()
+        data = source_path.read_bytes()
+        source_hash = hashlib.sha256(data).hexdigest()
+        read_seconds = time.perf_counter() - started
+    except Exception as e:
+        for result in results:
+            result.error = str(e)
+        return results
+    for result in results:
+        result.source_bytes = len(data)
+        result.source_hash = source_hash
+
+    pending: list[tuple] = []
+    for result, (target_path, quality, size, target_ssim, placeholder) in zip(results, outputs):
+        try:
+            started = time.perf_counter()
+            cached_path = None
+            if cache_dir is not None:
+                key = cache_key(source_hash, fmt, quality, size, target_ssim, matte)
+                cached_path = cache_object_path(cache_dir, key, fmt)
+                # SSIM 搜索的结果缺少附加信息时（早期版本写入的缓存）重新搜索，否则清单中会丢失选中的质量
+                if cached_path.exists() and (target_ssim is None or cache_sidecar_path(cached_path).exists()):
+                    restore_cached_output(result, cached_path, target_path, is_png, placeholder, started)
+                    continue
+            pending.append((result, target_path, quality, size, target_ssim, placeholder, cached_path))
+        except Exception as e:
+            result.error = str(e)
+    if not pending:
+        return results
+
+    decoding = pending[0][0]
+    decoding.timings["read"] = read_seconds
+    try:
+        started = time.perf_counter()
+        img = None
+        pixel_path = pixel_cache_path(pixel_cache_dir, source_hash, matte) if pixel_cache_dir is not None else None
+        if pixel_path is not None and pixel_path.exists():
+            img = read_pixel_cache(pixel_path)
+            if img is not None:
+                os.utime(pixel_path)
+                # 缓存的是 alpha 处理之后的像素
                 if is_png:
-                    if img.mode not in ("RGBA",):
-                        img = img.convert("RGBA")
-                else:
-                    if img.mode in ("RGBA", "LA"):
-                        background = Image.new("RGB", img.size, (255, 255, 255))
-                        mask = img.split()[3] if img.mode == "RGBA" else img.split()[1]
-                        background.paste(img, mask=mask)
-                        img = background
-                    elif img.mode != "RGB":
-                        img = img.convert("RGB")
-                img.save(target_path, "WEBP", quality=quality, method=6)
+                    decoding.alpha = "kept" if img.mode == "RGBA" else "dropped"
+                decoding.has_alpha = img.mode == "RGBA"
+                decoding.peak_bytes = image_bytes(img)
+                started = lap(decoding.timings, "pixels", started)
+        if img is None:
+            # 写像素缓存或输出全尺寸封面时需要完整分辨率，不能提前缩小解码
+            sizes = [size for _, _, _, size, *_ in pending]
+            early_size = None
+            if pixel_path is None and None not in sizes:
+                early_size = max(sizes, key=lambda size: size[0] * size[1])
+            img, started = decode_source(data, is_png, decoding, started, matte, early_size)
+            if pixel_path is not None:
+                # 写入缓存失败不影响本次转换
+                try:
+                    write_pixel_cache(pixel_path, img)
+                except OSError:
+                    pass
+                started = lap(decoding.timings, "pixel-store", started)
+        del data
+    except Exception as e:
+        for result, *_ in pending:
+            result.error = str(e)
+        return results
+
+    for result, target_path, quality, size, target_ssim, placeholder, cached_path in pending:
+        try:
+            started = time.perf_counter()
+            result.alpha, result.has_alpha = decoding.alpha, decoding.has_alpha
+            result.peak_bytes = max(result.peak_bytes, decoding.peak_bytes)
+            output = img
+            if size is not None:
+                output = fit_resize(img, size)
+                result.peak_bytes = max(result.peak_bytes, image_bytes(img) + image_bytes(output))
+                started = lap(result.timings, "resize", started)
+            result.width, result.height = output.size
+
+            if target_ssim is not None:
+                # 卡片变体本身就是显示尺寸，全尺寸封面按 2x 卡片尺寸比较
+                encoded, chosen, score = search_quality(output, fmt, target_ssim, size or SSIM_DISPLAY_SIZE)
+                result.extra["quality"] = chosen
+                result.extra["ssim"] = round(score, 5)
             else:
-                # AVIF: 用于 icons/backgrounds（小文件，vips 能正常解码）
-                if is_png:
-                    if img.mode not in ("RGBA",):
-                        img = img.convert("RGBA")
-                else:
-                    if img.mode in ("RGBA", "LA"):
-                        background = Image.new("RGB", img.size, (255, 255, 255))
-                        mask = img.split()[3] if img.mode == "RGBA" else img.split()[1]
-                        background.paste(img, mask=mask)
-                        img = background
-                    elif img.mode != "RGB":
-                        img = img.convert("RGB")
-                img.save(target_path, "AVIF", quality=quality, autotiling=False)
-
-            source_size = source_path.stat().st_size / 1024
-            target_size = target_path.stat().st_size / 1024
-            reduction = (1 - target_size / source_size) * 100 if source_size > 0 else 0
-            alpha_info = " (with alpha)" if is_png else ""
-            safe_print(f"[OK] {source_path.name} -> {target_path.name}{alpha_info}")
-            safe_print(f"  {source_size:.1f}KB -> {target_size:.1f}KB (减少 {reduction:.1f}%)")
+                encoded = encode_image(output, fmt, quality)
+            del output
+            started = lap(result.timings, "encode", started)
+
+            if placeholder:
+                result.extra["placeholder"] = make_placeholder(encoded)
+                started = lap(result.timings, "placeholder", started)
+
+            write_output(target_path, encoded)
+            if cached_path is not None:
+                # 写入缓存失败（只读目录、磁盘已满等）不影响本次转换
+                try:
+                    # 先写附加信息再放入对象：对象存在时附加信息总是完整的
+                    if target_ssim is not None:
+                        searched = {name: result.extra[name] for name in ("quality", "ssim")}
+                        write_json(cache_sidecar_path(cached_path), searched)
+                    link_file(target_path, cached_path)
+                except OSError:
+                    pass
+            lap(result.timings, "write", started)
+
+            result.target_bytes = len(encoded)
+            result.output_hash = hashlib.sha256(encoded).hexdigest()
+            record_worker(result)
+            result.ok = True
+        except Exception as e:
+            result.error = str(e)
+    # 尽早释放像素（像素缓存命中时同时解除内存映射）
+    del img
+    return results
+
+
+def write_runtime_image(source_path: Path, target_path: Path, fmt: str = "PNG") -> TaskResult:
+    """
+    运行时层：把提交的 AVIF/WebP 资源预解码为可直接渲染的数据
+    PNG：保留 alpha，压缩级别与 image.ts 运行时转换一致
+    RGBA：RAW_RGBA_HEADER 文件头 + 逐行 RGBA 像素
+    """
+    result = TaskResult("image", str(source_path), str(target_path), ok=False, fmt=fmt)
+    started = time.perf_counter()
+    try:
+        with Image.open(source_path) as img:
+            target_path.parent.mkdir(parents=True, exist_ok=True)
+            has_alpha = img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info
+            result.has_alpha = has_alpha
+            if fmt == "RGBA" or has_alpha:
+                img = img.convert("RGBA")
+            else:
+                img = img.convert("RGB")
+            result.width, result.height = img.size
 
+            if fmt == "RGBA":
+                data = RAW_RGBA_HEADER.pack(RAW_RGBA_MAGIC, 1, 4, img.width, img.height) + img.tobytes()
+            else:
+                buffer = io.BytesIO()
+                img.save(buffer, "PNG", compress_level=6)
+                data = buffer.getvalue()
+            write_output(target_path, data)
+
+        result.source_bytes = source_path.stat().st_size
+        result.target_bytes = target_path.stat().st_size
+        result.source_hash = file_sha256(source_path)
+        result.output_hash = file_sha256(target_path)
+        lap(result.timings, "runtime", started)
+        record_worker(result)
+        result.ok = True
     except Exception as e:
-        safe_print(f"[FAIL] 转换失败 {source_path.name}: {e}")
+        result.error = str(e)
+    return result
+
+
+def encode_candidate(img: Image.Image, fmt: str) -> bytes:
+    """按 --runtime-tier auto 的候选格式编码"""
+    if fmt in AUTO_QUALITY:
+        return encode_image(img, fmt, AUTO_QUALITY[fmt])
+    buffer = io.BytesIO()
+    if fmt == "PNG8":
+        method = Image.Quantize.FASTOCTREE if img.mode == "RGBA" else Image.Quantize.MEDIANCUT
+        img.quantize(256, method=method).save(buffer, "PNG", optimize=True)
+    else:
+        img.save(buffer, "PNG", compress_level=6)
+    return buffer.getvalue()
+
+
+def candidate_ssim(img: Image.Image, encoded: bytes) -> float:
+    """
+    候选编码解码后与源图的 SSIM：逐通道（RGB 及 alpha）计算 block_ssim，取最小值。
+    带透明度时比较预乘 alpha 后的颜色，全透明像素下的颜色差异不可见，不计入
+    """
+    mode = "RGBa" if img.mode == "RGBA" else img.mode
+    with Image.open(io.BytesIO(encoded)) as decoded:
+        decoded = decoded.convert(img.mode).convert(mode)
+    return min(
+        block_ssim(source_band.convert("F"), decoded_band.convert("F"))
+        for source_band, decoded_band in zip(img.convert(mode).split(), decoded.split())
+    )
 
 
-def copy_file(source_path: Path, target_path: Path):
+def measure_decode_ms(encoded: bytes, fmt: str) -> float:
+    """
+    本地解码耗时（毫秒，取多次中最快的一次）。
+    AVIF 在 image.ts 中要经 wasm-vips 解码再转成 PNG 交给渲染器，这里同样计入 PNG 编码
+    """
+    best = math.inf
+    for _ in range(AUTO_DECODE_RUNS):
+        started = time.perf_counter()
+        with Image.open(io.BytesIO(encoded)) as img:
+            img.load()
+            if fmt == "AVIF":
+                img.save(io.BytesIO(), "PNG", compress_level=6)
+        best = min(best, (time.perf_counter() - started) * 1000)
+    return best
+
+
+def auto_candidate_path(target_stem: Path, fmt: str) -> Path:
+    """auto 模式候选的暂存路径：按输出相对路径区分，多个源文件内容相同也不会互相覆盖"""
+    relative = target_stem.relative_to(TARGET_ASSETS)
+    return AUTO_CANDIDATES_DIR / relative.parent / f"{relative.name}.{fmt.lower()}"
+
+
+def encode_auto_candidates(
+    source_path: Path, target_stem: Path, ssim_floor: float = AUTO_SSIM_FLOOR
+) -> TaskResult:
+    """
+    运行时层 auto 模式的 worker 部分：编码全部候选格式，合格的候选暂存到 AUTO_CANDIDATES_DIR。
+    与源文件格式相同的候选直接使用源文件字节，避免二次有损压缩；
+    其余有损候选的 SSIM 低于 ssim_floor 时淘汰，无损 PNG 始终保底。
+    解码耗时不在这里测量：worker 之间争用 CPU，测得的耗时随调度变化，选出的格式不稳定（见 choose_auto_candidate）
+    """
+    result = TaskResult("image", str(source_path), str(target_stem), ok=False, fmt="AUTO")
+    started = time.perf_counter()
+    try:
+        data = source_path.read_bytes()
+        result.source_bytes = len(data)
+        result.source_hash = hashlib.sha256(data).hexdigest()
+        with Image.open(io.BytesIO(data)) as img:
+            source_format = img.format
+            result.has_alpha = img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info
+            img = img.convert("RGBA" if result.has_alpha else "RGB")
+        result.width, result.height = img.size
+
+        candidates: dict[str, dict] = {}
+        for fmt in AUTO_FORMATS:
+            encoded = data if fmt == source_format else encode_candidate(img, fmt)
+            candidates[fmt] = {"bytes": len(encoded)}
+            if fmt != source_format and fmt not in AUTO_LOSSLESS_FORMATS:
+                ssim = candidate_ssim(img, encoded)
+                candidates[fmt] |= {"ssim": round(ssim, 5), "rejected": ssim < ssim_floor}
+            if not candidates[fmt].get("rejected"):
+                write_output(auto_candidate_path(target_stem, fmt), encoded)
+        result.extra = {"candidates": candidates}
+        lap(result.timings, "runtime", started)
+        record_worker(result)
+        result.ok = True
+    except Exception as e:
+        result.error = str(e)
+    return result
+
+
+def choose_auto_candidate(result: TaskResult, weight: float):
+    """
+    运行时层 auto 模式的主进程部分：在没有其他任务运行时逐个测量合格候选的解码耗时，
+    写出 字节数 + weight × 解码毫秒数 最小的一个（目标 stem + 扩展名），补全 result 并删除暂存的候选
+    """
+    target_stem = Path(result.target)
+    candidates = result.extra["candidates"]
+    try:
+        scores: dict[str, float] = {}
+        for fmt, info in candidates.items():
+            if info.get("rejected"):
+                continue
+            encoded = auto_candidate_path(target_stem, fmt).read_bytes()
+            info["decode_ms"] = round(measure_decode_ms(encoded, fmt), 3)
+            scores[fmt] = len(encoded) + weight * info["decode_ms"]
+        chosen = min(scores, key=lambda fmt: scores[fmt])
+        encoded = auto_candidate_path(target_stem, chosen).read_bytes()
+
+        target_path = target_stem.with_name(target_stem.name + AUTO_EXTENSIONS[chosen])
+        write_output(target_path, encoded)
+        result.target = str(target_path)
+        result.target_bytes = len(encoded)
+        result.output_hash = hashlib.sha256(encoded).hexdigest()
+        result.extra["format"] = chosen
+    except Exception as e:
+        result.ok = False
+        result.error = str(e)
+    finally:
+        for fmt in candidates:
+            auto_candidate_path(target_stem, fmt).unlink(missing_ok=True)
+
+
+def write_runtime_index(manifest: dict[str, dict]) -> Path | None:
+    """
+    由构建清单中 auto 模式的输出生成 runtime/index.json：
+      { "version": 1, "files": { 源资源相对路径: {file, format, bytes} } }
+    没有 auto 输出时不生成，返回 None
+    """
+    files: dict[str, dict] = {}
+    for key, entry in sorted(manifest.items()):
+        if entry.get("format") != "AUTO":
+            continue
+        source_path = PROJECT_ROOT / entry["source"]
+        files[source_path.relative_to(TARGET_ASSETS).as_posix()] = {
+            "file": Path(key).relative_to("runtime").as_posix(),
+            "format": entry.get("extra", {}).get("format"),
+            "bytes": entry.get("output_size"),
+        }
+    if not files:
+        return None
+    RUNTIME_INDEX_PATH.parent.mkdir(parents=True, exist_ok=True)
+    write_json(RUNTIME_INDEX_PATH, {"version": 1, "files": files}, ensure_ascii=False, indent=2)
+    return RUNTIME_INDEX_PATH
+
+
+def pack_shelves(sizes: dict[str, tuple[int, int]], max_width: int, padding: int) -> tuple[dict[str, tuple[int, int]], int, int]:
+    """
+    货架式装箱：按高度、宽度降序（同尺寸按名称）逐行摆放，结果与输入顺序无关。
+    每个矩形四周都保留 padding 像素，返回 ({名称: (x, y)}, 图集宽, 图集高)
+    """
+    order = sorted(sizes, key=lambda name: (-sizes[name][1], -sizes[name][0], name))
+    positions: dict[str, tuple[int, int]] = {}
+    x = y = padding
+    shelf_height = 0
+    atlas_width = 0
+    for name in order:
+        width, height = sizes[name]
+        if x + width + padding > max_width and x > padding:
+            # 换到下一行
+            x = padding
+            y += shelf_height + padding
+            shelf_height = 0
+        positions[name] = (x, y)
+        x += width + padding
+        shelf_height = max(shelf_height, height)
+        atlas_width = max(atlas_width, x)
+    atlas_height = y + shelf_height + padding if order else 0
+    return positions, atlas_width, atlas_height
+
+
+def atlas_icon_box(name: str) -> tuple[int, int] | None:
+    """图标在图集中的缩放上限，不进图集的返回 None"""
+    for pattern, box in ATLAS_ICON_BOXES:
+        if pattern.fullmatch(name):
+            return box
+    return None
+
+
+def build_icon_atlas(source_dir: Path, target_image: Path, target_index: Path) -> TaskResult:
+    """
+    把 source_dir 中 ATLAS_ICON_BOXES 匹配的图标缩放到各自的上限后打包为一张 PNG 图集，
+    并写入 { 图标名: 矩形 } 索引。图标名为文件名 stem（与 image.ts 中 icons/{name}.avif 的 name 一致）
+    内容未变化时不改写文件，保持 mtime 稳定
+    """
+    result = TaskResult("image", str(source_dir), str(target_image), ok=False, fmt="PNG", has_alpha=True)
+    try:
+        sources = sorted(
+            p
+            for p in source_dir.iterdir()
+            if p.suffix.lower() in ATLAS_SOURCE_SUFFIXES and atlas_icon_box(p.stem) is not None
+        )
+        icons: dict[str, Image.Image] = {}
+        for source_path in sources:
+            with Image.open(source_path) as img:
+                icon = img.convert("RGBA")
+            box = atlas_icon_box(source_path.stem)
+            if icon.width > box[0] or icon.height > box[1]:
+                icon = ImageOps.contain(icon, box, Image.Resampling.LANCZOS)
+            icons[source_path.stem] = icon
+            result.source_bytes += source_path.stat().st_size
+
+        sizes = {name: img.size for name, img in icons.items()}
+        # 行宽取接近正方形的宽度（至少容纳最宽的图标），避免图集过于细长
+        area = sum((w + ATLAS_PADDING) * (h + ATLAS_PADDING) for w, h in sizes.values())
+        widest = max((w for w, _ in sizes.values()), default=0) + 2 * ATLAS_PADDING
+        shelf_width = min(ATLAS_MAX_WIDTH, max(widest, math.ceil(math.sqrt(area) * 1.15)))
+        positions, width, height = pack_shelves(sizes, shelf_width, ATLAS_PADDING)
+        sheet = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+        for name, (x, y) in positions.items():
+            sheet.paste(icons[name], (x, y))
+
+        buffer = io.BytesIO()
+        sheet.save(buffer, "PNG", compress_level=6)
+        index = {
+            "image": target_image.name,
+            "width": width,
+            "height": height,
+            "padding": ATLAS_PADDING,
+            "icons": {
+                source_path.stem: {
+                    "file": source_path.name,
+                    "x": positions[source_path.stem][0],
+                    "y": positions[source_path.stem][1],
+                    "w": sizes[source_path.stem][0],
+                    "h": sizes[source_path.stem][1],
+                }
+                for source_path in sources
+            },
+        }
+        index_bytes = json.dumps(index, ensure_ascii=False, indent=2).encode("utf-8")
+
+        for path, data in ((target_image, buffer.getvalue()), (target_index, index_bytes)):
+            if not path.exists() or path.read_bytes() != data:
+                write_output(path, data)
+
+        result.width, result.height = width, height
+        result.target_bytes = target_image.stat().st_size
+        result.output_hash = file_sha256(target_image)
+        result.ok = True
+    except Exception as e:
+        result.error = str(e)
+    return result
+
+
+def is_generated_font(path: Path) -> bool:
+    """子集化与实例化的输出与原字体放在一起，扫描源字体与清理过期输出时据此区分"""
+    return path.suffix.lower() in FONT_SOURCE_SUFFIXES and (
+        FONT_SUBSET_SUFFIX in path.suffixes or FONT_INSTANCE_SUFFIX in path.name
+    )
+
+
+def parse_axis_values(spec: str) -> dict[str, float]:
+    """解析 "wght=400,BEVL=80" 形式的轴坐标"""
+    axes: dict[str, float] = {}
+    for part in spec.split(","):
+        tag, sep, value = part.partition("=")
+        if not sep or not tag.strip():
+            raise argparse.ArgumentTypeError(f"无效的轴坐标: {part!r}（应为 tag=value）")
+        try:
+            axes[tag.strip()] = float(value)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"无效的轴坐标: {part!r}（应为 tag=value）") from None
+    return axes
+
+
+def font_instance_path(source_path: Path, axes: dict[str, float]) -> Path:
+    """实例文件名：{stem}.instance-wght700-BEVL100{suffix}"""
+    label = "-".join(f"{tag}{value:g}" for tag, value in sorted(axes.items()))
+    return source_path.with_name(f"{source_path.stem}{FONT_INSTANCE_SUFFIX}{label}{source_path.suffix}")
+
+
+def font_subset_path(font_path: Path) -> Path:
+    """子集文件名：{stem}.subset{suffix}，实例的子集为 {stem}.instance-<axes>.subset{suffix}"""
+    return font_path.with_name(font_path.stem + FONT_SUBSET_SUFFIX + font_path.suffix)
+
+
+def pin_font_axes(font, axes: dict[str, float]):
+    """把可变字体固定在给定轴坐标上；全部轴都已固定时移除残留的变体表"""
+    from fontTools.varLib import instancer
+
+    instancer.instantiateVariableFont(font, axes, inplace=True)
+    if "fvar" not in font:
+        for tag in FONT_VARIATION_TABLES:
+            if tag in font:
+                del font[tag]
+
+
+def instantiate_font(source_path: Path, target_path: Path, axes: dict[str, float]) -> TaskResult:
+    """
+    把可变字体固定在给定轴坐标上，生成静态实例并移除变体表
+    未指定的轴保持可变；字体名称保持不变，可直接替换原字体使用
+    """
+    result = TaskResult("font", str(source_path), str(target_path), ok=False, fmt="INSTANCE")
+    started = time.perf_counter()
+    try:
+        from fontTools.ttLib import TTFont
+
+        with TTFont(source_path) as font:
+            glyphs = len(font.getGlyphOrder())
+            pin_font_axes(font, axes)
+            target_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = temporary_path(target_path)
+            font.save(tmp_path)
+            os.replace(tmp_path, target_path)
+
+        result.source_bytes = source_path.stat().st_size
+        result.target_bytes = target_path.stat().st_size
+        result.source_hash = file_sha256(source_path)
+        result.output_hash = file_sha256(target_path)
+        result.extra = {"glyphs_before": glyphs, "glyphs_after": glyphs, "axes": axes}
+        lap(result.timings, "instance", started)
+        record_worker(result)
+        result.ok = True
+    except ImportError:
+        result.error = "可变字体实例化需要 fonttools（pip install fonttools）"
+    except Exception as e:
+        result.error = str(e)
+    return result
+
+
+def collect_font_text(titles: list[str], text_files: list[Path]) -> str:
+    """收集子集化所需的字符：全部歌名 + UI 文本文件内容 + 可打印 ASCII，去重排序"""
+    chars = set(chr(c) for c in range(0x20, 0x7F))
+    for title in titles:
+        chars.update(unicodedata.normalize("NFC", title))
+    for text_file in text_files:
+        chars.update(text_file.read_text(encoding="utf-8"))
+    return "".join(sorted(c for c in chars if c.isprintable() or c == " "))
+
+
+def rename_font_family(font, suffix: str):
+    """给字体族名、全名与 PostScript 名加上后缀"""
+    for record in font["name"].names:
+        if record.nameID in (1, 4, 16, 18, 21):
+            record.string = str(record) + suffix
+        elif record.nameID == 6:
+            record.string = str(record) + suffix.replace(" ", "-")
+
+
+def subset_font(
+    source_path: Path, target_path: Path, text: str, axes: dict[str, float] | None = None
+) -> TaskResult:
+    """
+    按给定字符集对字体子集化，写到 target_path
+    保留全部 OpenType 特性与可变字体轴，只裁剪字形；字体族名加 FONT_SUBSET_FAMILY_SUFFIX。
+    给定 axes 时先按 instantiate_font 相同的方式固定轴坐标，得到静态实例的子集
+    """
+    result = TaskResult("font", str(source_path), str(target_path), ok=False, fmt="SUBSET")
+    started = time.perf_counter()
+    try:
+        from fontTools import subset
+        from fontTools.ttLib import TTFont
+
+        options = subset.Options()
+        options.layout_features = ["*"]
+        options.name_IDs = ["*"]
+        options.name_languages = ["*"]
+        options.notdef_outline = True
+
+        with TTFont(source_path) as font:
+            glyphs_before = len(font.getGlyphOrder())
+            if axes:
+                pin_font_axes(font, axes)
+            subsetter = subset.Subsetter(options)
+            subsetter.populate(text=text)
+            subsetter.subset(font)
+            rename_font_family(font, FONT_SUBSET_FAMILY_SUFFIX)
+            glyphs_after = len(font.getGlyphOrder())
+            target_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = temporary_path(target_path)
+            font.save(tmp_path)
+            os.replace(tmp_path, target_path)
+
+        result.source_bytes = source_path.stat().st_size
+        result.target_bytes = target_path.stat().st_size
+        result.source_hash = file_sha256(source_path)
+        result.output_hash = file_sha256(target_path)
+        result.extra = {"glyphs_before": glyphs_before, "glyphs_after": glyphs_after}
+        lap(result.timings, "subset", started)
+        record_worker(result)
+        result.ok = True
+    except ImportError:
+        result.error = "字体子集化需要 fonttools（pip install fonttools）"
+    except Exception as e:
+        result.error = str(e)
+    return result
+
+
+def difference_hash(img: Image.Image, hash_size: int = 8) -> str:
+    """dHash：缩放为 (hash_size+1)×hash_size 灰度图，比较相邻像素，返回十六进制字符串"""
+    small = img.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+    pixels = small.tobytes()
+    bits = 0
+    for y in range(hash_size):
+        row = pixels[y * (hash_size + 1) : (y + 1) * (hash_size + 1)]
+        for x in range(hash_size):
+            bits = (bits << 1) | (row[x] > row[x + 1])
+    return f"{bits:0{hash_size * hash_size // 4}x}"
+
+
+def fingerprint_image(source_path: Path, perceptual: bool = False) -> TaskResult:
+    """
+    计算插图指纹：按 convert_outputs 相同的模式处理后对像素求 sha256，
+    perceptual 为 True 时额外计算 dHash，用于发现近似重复
+    """
+    result = TaskResult("fingerprint", str(source_path), "", ok=False)
+    try:
+        is_png = source_path.suffix.lower() == ".png"
+        with Image.open(source_path) as img:
+            img = normalize_mode(img, is_png)
+            digest = hashlib.sha256(f"{img.mode}:{img.width}x{img.height}:".encode())
+            digest.update(img.tobytes())
+            result.extra = {"pixel_hash": digest.hexdigest()}
+            if perceptual:
+                result.extra["phash"] = difference_hash(img)
+            result.width, result.height = img.size
+        result.source_bytes = source_path.stat().st_size
+        result.source_hash = file_sha256(source_path)
+        result.ok = True
+    except Exception as e:
+        result.error = str(e)
+    return result
+
+
+def group_duplicates(fingerprints: dict[str, dict], threshold: int | None = None) -> dict[str, str]:
+    """
+    根据指纹把插图分组，返回 { 文件名: 组内代表文件名 }
+    像素哈希相同即视为重复；threshold 不为 None 时 dHash 汉明距离不超过它的也归为一组。
+    代表取组内按名称排序的第一个，保证结果稳定
+    """
+    names = sorted(fingerprints)
+    parent = {name: name for name in names}
+
+    def find(name: str) -> str:
+        while parent[name] != name:
+            parent[name] = parent[parent[name]]
+            name = parent[name]
+        return name
+
+    def union(a: str, b: str):
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            # 名称较小者作为根
+            if root_b < root_a:
+                root_a, root_b = root_b, root_a
+            parent[root_b] = root_a
+
+    by_pixels: dict[str, str] = {}
+    for name in names:
+        pixel_hash = fingerprints[name]["pixel_hash"]
+        if pixel_hash in by_pixels:
+            union(by_pixels[pixel_hash], name)
+        else:
+            by_pixels[pixel_hash] = name
+
+    if threshold is not None:
+        hashes = [(name, int(fingerprints[name]["phash"], 16)) for name in names if "phash" in fingerprints[name]]
+        for i, (name_a, hash_a) in enumerate(hashes):
+            for name_b, hash_b in hashes[i + 1 :]:
+                if (hash_a ^ hash_b).bit_count() <= threshold:
+                    union(name_a, name_b)
+
+    return {name: find(name) for name in names}
+
+
+def fingerprint_sources(
+    sources: dict[str, Path],
+    old_fingerprints: dict[str, dict],
+    new_fingerprints: dict[str, dict],
+    perceptual: bool,
+    executor_kind: str,
+    max_workers: int,
+    cost_model: "CostModel",
+    admission: "MemoryAdmission",
+) -> dict[str, dict]:
+    """
+    计算 { 文件名: 指纹 }；源文件 size/mtime 未变时复用构建清单中的指纹，其余在进程池中计算。
+    指纹任务同样完整解码插图，与转换任务一样经过内存准入。新指纹写入 new_fingerprints（键为 source_key）
+    """
+    fingerprints: dict[str, dict] = {}
+    pending: dict[str, Path] = {}
+    for name, source_path in sources.items():
+        key = source_key(source_path)
+        cached = old_fingerprints.get(key)
+        stat = source_path.stat()
+        if (
+            cached
+            and cached.get("source_size") == stat.st_size
+            and cached.get("source_mtime_ns") == stat.st_mtime_ns
+            and (not perceptual or "phash" in cached)
+        ):
+            fingerprints[name] = new_fingerprints[key] = cached
+        else:
+            pending[name] = source_path
+
+    if pending:
+        tasks = [
+            (estimate_memory(cost_model, "image", path), fingerprint_image, (path, perceptual), name)
+            for name, path in pending.items()
+        ]
+        with create_executor(executor_kind, max_workers) as executor:
+            for name, future in admission.run(executor, tasks, max_workers):
+                result = future.result()
+                if not result.ok:
+                    safe_print(f"[W]  无法计算插图指纹 {name}: {result.error}")
+                    continue
+                source_path = pending[name]
+                record = {
+                    "source_size": result.source_bytes,
+                    "source_mtime_ns": source_path.stat().st_mtime_ns,
+                    "source_hash": result.source_hash,
+                    **result.extra,
+                }
+                fingerprints[name] = new_fingerprints[source_key(source_path)] = record
+    return fingerprints
+
+
+def copy_file(source_path: Path, target_path: Path) -> TaskResult:
     """复制文件"""
+    result = TaskResult("copy", str(source_path), str(target_path), ok=False)
+    started = time.perf_counter()
     try:
         target_path.parent.mkdir(parents=True, exist_ok=True)
-        shutil.copy2(source_path, target_path)
-        safe_print(f"[C] 复制: {source_path.name}")
+        tmp_path = temporary_path(target_path)
+        shutil.copy2(source_path, tmp_path)
+        os.replace(tmp_path, target_path)
+        result.source_bytes = result.target_bytes = source_path.stat().st_size
+        lap(result.timings, "copy", started)
+        record_worker(result)
+        result.ok = True
     except Exception as e:
-        safe_print(f"[FAIL] 复制失败 {source_path.name}: {e}")
+        result.error = str(e)
+    return result
+
 
+def record_output(
+    manifest: dict[str, dict],
+    result: TaskResult,
+    size: tuple[int, int] | None = None,
+    options: dict | None = None,
+) -> str:
+    """将成功的转换结果写入构建清单，返回清单键"""
+    source_path = Path(result.source)
+    target_path = Path(result.target)
+    key = manifest_key(target_path)
+    manifest[key] = {
+        "source": source_key(source_path),
+        "source_hash": result.source_hash,
+        "source_size": result.source_bytes,
+        "source_mtime_ns": source_path.stat().st_mtime_ns,
+        "quality": result.quality,
+        "format": result.fmt,
+        "size": list(size) if size else None,
+        "options": options,
+        "width": result.width,
+        "height": result.height,
+        "encoder": encoder_version(result.fmt),
+        "output_hash": result.output_hash,
+        "output_size": result.target_bytes,
+    }
+    if result.extra:
+        manifest[key]["extra"] = result.extra
+    return key
 
-def main():
-    import os
 
-    max_workers = min(32, (os.cpu_count() or 4) * 2)
+def completed_cover_map(
+    cover_map: dict[str, str], cover_outputs: dict[str, list[Path]], manifest: dict[str, dict]
+) -> dict[str, str]:
+    """只保留所有输出（全尺寸封面与变体）都已完成的歌名，用于构建中断时写出可用的 cover-map.json"""
+    completed = {
+        webp_filename
+        for webp_filename, targets in cover_outputs.items()
+        if all(manifest_key(target) in manifest for target in targets)
+    }
+    return {title: webp_filename for title, webp_filename in cover_map.items() if webp_filename in completed}
 
+
+def raise_interrupt(signum, frame):
+    """把 SIGTERM（CI 超时等）转换为 KeyboardInterrupt，走与 Ctrl-C 相同的中断处理"""
+    raise KeyboardInterrupt
+
+
+def build_cover_variants(
+    variant_targets: dict[str, dict[str, Path]], manifest: dict[str, dict]
+) -> dict[str, dict[str, dict]]:
+    """根据构建清单生成 { webp_filename: { "1x": {file, width, height}, ... } }，只收录成功输出的变体"""
+    cover_variants: dict[str, dict[str, dict]] = {}
+    for webp_filename, variants in variant_targets.items():
+        entries: dict[str, dict] = {}
+        for scale, variant_path in variants.items():
+            entry = manifest.get(manifest_key(variant_path))
+            if not entry:
+                continue
+            entries[scale] = {
+                "file": variant_path.relative_to(TARGET_ASSETS / "covers").as_posix(),
+                "width": entry["width"],
+                "height": entry["height"],
+            }
+        if entries:
+            cover_variants[webp_filename] = entries
+    return cover_variants
+
+
+def build_cover_index(
+    songs: list[SongEntry],
+    webp_by_png: dict[str, str],
+    variant_targets: dict[str, dict[str, Path]],
+    manifest: dict[str, dict],
+) -> dict:
+    """
+    生成统一的封面索引（cover-index.json）：
+      covers: [ {file, width, height, variants, aliases} ]，每张插图只存一次，按文件名排序，下标即封面 id
+              aliases 为去重时归并到该封面的原始插图文件名
+      charts: { BeatmapId: 封面 id }（同一 BeatmapId 以最后出现者为准，与原 rolldown 插件一致）
+      titles: { 规范化歌名: 封面 id }（以最先出现者为准，与 parse_out_json 一致）
+    """
+    cover_variants = build_cover_variants(variant_targets, manifest)
+    files = sorted(set(webp_by_png.values()))
+    cover_ids = {webp_filename: i for i, webp_filename in enumerate(files)}
+
+    covers: list[dict] = []
+    for webp_filename in files:
+        cover: dict = {"file": webp_filename}
+        entry = manifest.get(manifest_key(TARGET_ASSETS / "covers" / webp_filename))
+        if entry:
+            cover["width"] = entry["width"]
+            cover["height"] = entry["height"]
+        if webp_filename in cover_variants:
+            cover["variants"] = cover_variants[webp_filename]
+        aliases = sorted(
+            png_filename
+            for png_filename, target in webp_by_png.items()
+            if target == webp_filename and Path(png_filename).stem + ".webp" != webp_filename
+        )
+        if aliases:
+            cover["aliases"] = aliases
+        covers.append(cover)
+
+    charts: dict[str, int] = {}
+    titles: dict[str, int] = {}
+    for song in songs:
+        webp_filename = webp_by_png.get(song.png_filename)
+        if webp_filename is None:
+            continue
+        cover_id = cover_ids[webp_filename]
+        for beatmap_id in song.beatmap_ids:
+            charts[beatmap_id] = cover_id
+        for title in song.titles:
+            titles.setdefault(normalize_title(title), cover_id)
+
+    return {"version": 1, "covers": covers, "charts": charts, "titles": titles}
+
+
+def write_placeholder_index(variant_targets: dict[str, dict[str, Path]], manifest: dict[str, dict]) -> Path:
+    """
+    汇总最小卡片变体记录的占位数据，写出 covers/placeholders.json：
+      { "version": 1, "size": [w, h], "covers": { webp_filename: {color, data} } }
+    渲染器在封面读取失败或快速渲染时直接使用
+    """
+    smallest = f"{min(COVER_SCALES)}x"
+    covers: dict[str, dict] = {}
+    for webp_filename, variants in sorted(variant_targets.items()):
+        variant_path = variants.get(smallest)
+        entry = manifest.get(manifest_key(variant_path)) if variant_path else None
+        placeholder = (entry or {}).get("extra", {}).get("placeholder")
+        if placeholder:
+            covers[webp_filename] = placeholder
+    path = TARGET_ASSETS / "covers" / "placeholders.json"
+    index = {"version": 1, "size": list(PLACEHOLDER_SIZE), "covers": covers}
+    write_json(path, index, ensure_ascii=False, separators=(",", ":"))
+    return path
+
+
+def write_font_subset_report(font_outputs: list[Path], manifest: dict[str, dict]) -> dict:
+    """根据构建清单汇总字形数与节省的字节数，写入 FONT_SUBSET_REPORT_PATH"""
+    fonts = []
+    for target_path in font_outputs:
+        entry = manifest.get(manifest_key(target_path))
+        if not entry:
+            continue
+        fonts.append(
+            {
+                "source": entry["source"],
+                "target": manifest_key(target_path),
+                "glyphs_before": entry.get("extra", {}).get("glyphs_before"),
+                "glyphs_after": entry.get("extra", {}).get("glyphs_after"),
+                "bytes_before": entry["source_size"],
+                "bytes_after": entry["output_size"],
+                "bytes_saved": entry["source_size"] - entry["output_size"],
+            }
+        )
+    report = {"fonts": fonts, "bytes_saved": sum(font["bytes_saved"] for font in fonts)}
+    write_json(FONT_SUBSET_REPORT_PATH, report, ensure_ascii=False, indent=2)
+    return report
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """最近秩百分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(fraction * len(ordered)))
+    return ordered[rank - 1]
+
+
+def worker_label(pid: int) -> str:
+    """报告中的 worker 名：子进程用进程号，构建进程本身（线程执行器、主进程中的任务）记为 main"""
+    if not pid:
+        return ""
+    return "main" if pid == os.getpid() else str(pid)
+
+
+def build_report(
+    results: list[TaskResult],
+    wall_seconds: float,
+    executor_kind: str,
+    max_workers: int,
+    skipped: int,
+    phases: dict[str, float],
+) -> dict:
+    """
+    汇总本次构建的逐文件与整体数据：
+    各阶段 p50/p95/max/total、输入输出字节、逐任务的像素缓冲区峰值、各 worker 的 RSS 峰值、worker 利用率
+    """
+    stage_values: dict[str, list[float]] = {}
+    files = []
+    busy_seconds = 0.0
+    for result in sorted(results, key=lambda r: (r.kind, r.target or r.source)):
+        busy = sum(result.timings.values())
+        busy_seconds += busy
+        for stage, seconds in result.timings.items():
+            stage_values.setdefault(stage, []).append(seconds)
+        files.append(
+            {
+                "kind": result.kind,
+                "source": source_key(Path(result.source)),
+                "target": display_path(Path(result.target)) if result.target else "",
+                "ok": result.ok,
+                "bytes_in": result.source_bytes,
+                "bytes_out": result.target_bytes,
+                "timings": {stage: round(seconds, 6) for stage, seconds in result.timings.items()},
+                "busy": round(busy, 6),
+                "peak_bytes": result.peak_bytes,
+                "worker": worker_label(result.worker),
+                "cached": result.cached,
+                "alpha": result.alpha,
+            }
+        )
+
+    stages = {
+        stage: {
+            "count": len(values),
+            "p50": round(percentile(values, 0.5), 6),
+            "p95": round(percentile(values, 0.95), 6),
+            "max": round(max(values), 6),
+            "total": round(sum(values), 6),
+        }
+        for stage, values in sorted(stage_values.items())
+    }
+    worker_rss: dict[str, int] = {}
+    for result in results:
+        if result.worker:
+            label = worker_label(result.worker)
+            worker_rss[label] = max(worker_rss.get(label, 0), result.worker_rss_kb)
+    capacity = wall_seconds * max_workers
+    return {
+        "version": 1,
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "executor": executor_kind,
+        "workers": max_workers,
+        "wall_seconds": round(wall_seconds, 6),
+        "phases": {name: round(seconds, 6) for name, seconds in phases.items()},
+        "tasks": len(results),
+        "failed": sum(1 for r in results if not r.ok),
+        "skipped": skipped,
+        "cached": sum(1 for r in results if r.cached),
+        "alpha": {
+            "kept": sum(1 for r in results if r.alpha == "kept"),
+            "dropped": sum(1 for r in results if r.alpha == "dropped"),
+        },
+        "bytes_in": sum(r.source_bytes for r in results),
+        "bytes_out": sum(r.target_bytes for r in results),
+        "peak_bytes_max": max((r.peak_bytes for r in results), default=0),
+        # 每个 worker 进程的 RSS 峰值（线程执行器下只有构建进程本身，记为 main）
+        "worker_rss_kb": worker_rss,
+        "worker_utilization": round(busy_seconds / capacity, 4) if capacity > 0 else 0.0,
+        "stages": stages,
+        "files": files,
+    }
+
+
+def probe_pixels(path: Path) -> int:
+    """只读取文件头获取像素数，不解码"""
+    try:
+        with Image.open(path) as img:
+            return img.width * img.height
+    except Exception:
+        return 0
+
+
+class CostModel:
+    """
+    估算每个任务的耗时，用于最长任务优先（LPT）调度。
+    优先使用上一次 build-report.json 中同一输出的实际耗时；
+    否则按源图像素数 × 每百万像素耗时（由上次报告校准）估算，字体按文件大小估算。
+    """
+
+    def __init__(self, report_path: Path):
+        self.previous: dict[str, float] = {}
+        self.pixels: dict[Path, int] = {}
+        self.seconds_per_mpx = DEFAULT_SECONDS_PER_MPX
+        try:
+            with open(report_path, encoding="utf-8") as f:
+                report = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        rates: list[float] = []
+        for item in report.get("files", []):
+            # 缓存命中的耗时不反映真实转换代价
+            if not item.get("ok") or not item.get("target") or item.get("cached"):
+                continue
+            self.previous[item["target"]] = item["busy"]
+            # 每百万像素耗时只用完整解码的全尺寸输出校准（不含缩放变体与像素缓存命中）
+            timings = item.get("timings", {})
+            if item["kind"] == "image" and "resize" not in timings and "pixels" not in timings:
+                pixels = self.source_pixels(PROJECT_ROOT / item["source"])
+                if pixels:
+                    rates.append(item["busy"] / (pixels / 1_000_000))
+        if rates:
+            self.seconds_per_mpx = percentile(rates, 0.5)
+
+    def source_pixels(self, path: Path) -> int:
+        if path not in self.pixels:
+            self.pixels[path] = probe_pixels(path)
+        return self.pixels[path]
+
+    def estimate(self, kind: str, source_path: Path, target_path: Path, size: tuple[int, int] | None = None) -> float:
+        previous = self.previous.get(display_path(target_path))
+        if previous is not None:
+            return previous
+        if kind == "image":
+            cost = self.source_pixels(source_path) / 1_000_000 * self.seconds_per_mpx
+            return cost * VARIANT_COST_FACTOR if size is not None else cost
+        try:
+            megabytes = source_path.stat().st_size / 1024 / 1024
+        except OSError:
+            return 0.0
+        return megabytes * DEFAULT_SECONDS_PER_FONT_MB if kind == "font" else megabytes / 200
+
+
+def estimate_memory(cost_model: "CostModel", kind: str, source_path: Path) -> int:
+    """估算任务运行时的内存占用（字节），只读取文件头"""
+    if kind == "image":
+        return cost_model.source_pixels(source_path) * 4 * IMAGE_MEMORY_FACTOR
+    if kind == "font":
+        try:
+            return source_path.stat().st_size * FONT_MEMORY_FACTOR
+        except OSError:
+            return 0
+    return 0
+
+
+def available_memory() -> int | None:
+    """容器的 cgroup 内存限制，没有限制时取物理内存；都无法获取时返回 None"""
+    for limit_path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            value = Path(limit_path).read_text().strip()
+        except OSError:
+            continue
+        # cgroup v2 无限制时为 "max"，v1 为一个接近 2^63 的值
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value)
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+class MemoryAdmission:
+    """
+    内存准入：按给定顺序提交任务，在途任务的估算占用之和不超过 budget（0 表示不限制）。
+    放不下的任务先跳过，让更小的任务填满剩余预算；即使单个任务超出预算，也会在没有其他任务运行时单独执行
+    """
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        # 有空闲 worker 却因预算不足而暂缓提交过的任务数（每个任务只计一次）
+        self.throttled = 0
+
+    def run(self, executor, tasks: list[tuple], max_workers: int):
+        """tasks 为 (估算占用, worker 函数, 参数, 附带数据)；每完成一个任务产出 (附带数据, future)"""
+        pending = list(enumerate(tasks))
+        deferred: set[int] = set()
+        in_flight: dict = {}
+        in_flight_bytes = 0
+        while pending or in_flight:
+            index = 0
+            while index < len(pending) and len(in_flight) < max_workers:
+                position, (footprint, fn, fn_args, tag) = pending[index]
+                if self.budget and in_flight and in_flight_bytes + footprint > self.budget:
+                    if position not in deferred:
+                        deferred.add(position)
+                        self.throttled += 1
+                    index += 1
+                    continue
+                in_flight[executor.submit(fn, *fn_args)] = (footprint, tag)
+                in_flight_bytes += footprint
+                pending.pop(index)
+
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                footprint, tag = in_flight.pop(future)
+                in_flight_bytes -= footprint
+                yield tag, future
+
+
+def job_outputs(job: tuple) -> list[tuple[Path, dict]]:
+    """作业的各个输出：(目标路径, 写入构建清单时的附加参数)；单输出作业的目标是参数中的第二项"""
+    kind, fn, fn_args, record_kwargs = job
+    if "outputs" in record_kwargs:
+        return record_kwargs["outputs"]
+    return [(fn_args[1], record_kwargs)]
+
+
+def lpt_makespan(costs: list[float], workers: int) -> float:
+    """按 LPT 顺序贪心分配到负载最小的 worker，返回预计总耗时（关键路径）"""
+    loads = [0.0] * max(1, workers)
+    for cost in sorted(costs, reverse=True):
+        heapq.heapreplace(loads, loads[0] + cost)
+    return max(loads)
+
+
+def parse_shard(spec: str) -> tuple[int, int]:
+    """解析 --shard K/N（K 从 1 开始）"""
+    match = re.fullmatch(r"(\d+)/(\d+)", spec.strip())
+    if not match:
+        raise argparse.ArgumentTypeError(f"分片格式应为 K/N: {spec!r}")
+    index, count = int(match.group(1)), int(match.group(2))
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"分片序号超出范围: {spec!r}")
+    return index, count
+
+
+def shard_of(source_path: Path, shard_count: int) -> int:
+    """
+    按源文件路径的稳定哈希分片（1 起）。
+    同一源文件的全部输出落在同一分片，任何节点对同一棵源码树的划分结果都一致。
+    """
+    digest = hashlib.sha1(source_key(source_path).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % shard_count + 1
+
+
+def shard_dir(shard: tuple[int, int]) -> Path:
+    return SHARDS_DIR / f"{shard[0]}-of-{shard[1]}"
+
+
+def merge_shards(expected_count: int | None, pack: bool = False) -> int:
+    """
+    合并各分片的部分构建清单与 cover-map.json，校验后写出最终的 cover-map.json、
+    cover-index.json 与构建清单，并清理过期输出和分片目录。校验失败时不改动资产目录，返回 1
+    pack 为 True 时最后更新资源包，否则旧资源包已过期，随过期文件一起删除
+    """
     print("=" * 60)
-    print("Milthm 资产转换脚本（多线程模式）")
-    print(f"[*] 并发线程数: {max_workers}")
+    print("Milthm 资产转换脚本（合并分片）")
     print("=" * 60)
 
+    errors: list[str] = []
+    shard_infos: list[tuple[Path, dict]] = []
+    for directory in sorted(SHARDS_DIR.glob("*-of-*")) if SHARDS_DIR.is_dir() else []:
+        try:
+            with open(directory / "shard.json", encoding="utf-8") as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            errors.append(f"{directory.name}: 缺少或无法读取 shard.json")
+            continue
+        if info.get("version") != MANIFEST_VERSION:
+            errors.append(f"{directory.name}: 分片格式版本不符")
+            continue
+        shard_infos.append((directory, info))
+
+    counts = {info["shards"] for _, info in shard_infos}
+    if expected_count is not None:
+        counts.add(expected_count)
+    if len(counts) > 1:
+        errors.append(f"分片总数不一致: {sorted(counts)}")
+    shard_count = max(counts) if counts else 0
+    indices = [info["shard"] for _, info in shard_infos]
+    missing = sorted(set(range(1, shard_count + 1)) - set(indices))
+    if not shard_infos:
+        errors.append(f"没有找到分片输出: {SHARDS_DIR}")
+    if missing:
+        errors.append(f"缺少分片: {', '.join(f'{index}/{shard_count}' for index in missing)}")
+    if len(indices) != len(set(indices)):
+        errors.append("存在重复的分片")
+
+    outputs: dict[str, dict] = {}
+    fingerprints: dict[str, dict] = {}
+    partial_map: dict[str, str] = {}
+    webp_by_png: dict[str, str] = {}
+    variant_keys: dict[str, dict[str, str]] = {}
+    cover_keys: dict[str, list[str]] = {}
+    generated: set[str] = set()
+    for directory, info in shard_infos:
+        for key, entry in load_manifest(directory / MANIFEST_PATH.name).items():
+            if key in outputs and outputs[key].get("output_hash") != entry.get("output_hash"):
+                errors.append(f"{directory.name}: 输出冲突 {key}")
+            outputs[key] = entry
+            try:
+                if (TARGET_ASSETS / key).stat().st_size != entry.get("output_size"):
+                    errors.append(f"{directory.name}: 输出大小与清单不符 {key}")
+            except OSError:
+                errors.append(f"{directory.name}: 输出文件缺失 {key}")
+        fingerprints.update(load_manifest(directory / MANIFEST_PATH.name, "fingerprints"))
+        try:
+            with open(directory / "cover-map.json", encoding="utf-8") as f:
+                shard_map = json.load(f)
+        except (OSError, ValueError):
+            errors.append(f"{directory.name}: 缺少或无法读取 cover-map.json")
+            shard_map = {}
+        for title, webp_filename in shard_map.items():
+            if partial_map.get(title, webp_filename) != webp_filename:
+                errors.append(f"{directory.name}: 歌名映射冲突 {title}")
+            partial_map[title] = webp_filename
+        webp_by_png.update(info.get("webp_by_png", {}))
+        variant_keys.update(info.get("variants", {}))
+        cover_keys.update(info.get("covers", {}))
+        generated.update(info.get("generated", []))
+
+    # 每张封面登记的输出（全尺寸封面与各变体）都必须已成功生成（分片中有失败任务时需先用 --resume 重跑该分片）
+    for webp_filename in sorted(variant_keys.keys() | cover_keys.keys()):
+        keys = set(variant_keys.get(webp_filename, {}).values()) | set(cover_keys.get(webp_filename, []))
+        for key in sorted(keys):
+            if key not in outputs:
+                errors.append(f"封面输出未生成: {key}")
+
+    # 分片与 out.json 必须一致：分片里的歌名都在 out.json 中，out.json 中有插图的歌名也都由某个分片生成
+    songs = parse_songs(MIL_RESOURCE_ROOT / "out.json")
+    title_to_png = map_titles_to_png(songs)
+    for title in partial_map.keys() - title_to_png.keys():
+        errors.append(f"歌名不在 out.json 中（分片可能已过期）: {title}")
+    illustration_dir = MIL_RESOURCE_ROOT / "illustration"
+    for title, png_filename in title_to_png.items():
+        if title not in partial_map and (illustration_dir / png_filename).exists():
+            errors.append(f"歌名未被任何分片生成（分片可能已过期或缺失）: {title}")
+
+    if errors:
+        for error in errors:
+            safe_print(f"[FAIL] {error}")
+        print(f"\n[E] 合并失败: {len(errors)} 个错误，资产目录未改动")
+        return 1
+
+    # 按 out.json 顺序输出，与不分片构建的 cover-map.json 完全一致
+    cover_map = {title: partial_map[title] for title in title_to_png if title in partial_map}
+    cover_map_path = TARGET_ASSETS / "covers" / "cover-map.json"
+    write_json(cover_map_path, cover_map, ensure_ascii=False, indent=2)
+    print(f"[J] cover-map.json 已生成: {len(cover_map)} 条映射（{shard_count} 个分片）")
+
+    variant_targets = {
+        webp_filename: {scale: TARGET_ASSETS / key for scale, key in variants.items()}
+        for webp_filename, variants in variant_keys.items()
+    }
+    cover_index = build_cover_index(songs, webp_by_png, variant_targets, outputs)
+    cover_index_path = TARGET_ASSETS / "covers" / "cover-index.json"
+    write_json(cover_index_path, cover_index, ensure_ascii=False, separators=(",", ":"))
+    print(f"[J] cover-index.json 已生成: {len(cover_index['covers'])} 张封面")
+
+    placeholder_index_path = write_placeholder_index(variant_targets, outputs)
+    runtime_index_path = write_runtime_index(outputs)
+    keep = {TARGET_ASSETS / key for key in outputs} | {TARGET_ASSETS / key for key in generated}
+    keep |= {cover_map_path, cover_index_path, placeholder_index_path}
+    if runtime_index_path:
+        keep.add(runtime_index_path)
+    if pack:
+        keep |= {PACK_BLOB_PATH, PACK_INDEX_PATH}
+    removed = remove_orphans(keep)
+    save_manifest(MANIFEST_PATH, outputs, fingerprints)
+    shutil.rmtree(SHARDS_DIR, ignore_errors=True)
+    print(f"[J] 构建清单已更新: {len(outputs)} 条记录，清理 {removed} 个过期文件与分片目录")
+    if pack:
+        pack_assets()
+    print(f"[DONE] 资产已保存到: {TARGET_ASSETS}")
+    return 0
+
+
+def align_up(value: int, alignment: int) -> int:
+    return (value + alignment - 1) // alignment * alignment
+
+
+def collect_pack_files() -> dict[str, Path]:
+    """
+    收集要打包的文件：键为相对 TARGET_ASSETS 的路径（与 image.ts 的相对路径一致），按路径排序。
+    同一资源有多份时只打包 image.ts 实际读取的那一份（按它的查找顺序取第一个存在的）：
+      封面取 2x 变体，没有变体时才取全尺寸封面；1x 变体只用于生成占位，不打包
+      .avif 源图依次取图标图集、auto 运行时层、PNG 运行时层，都没有时才打包源图；其余文件原样打包
+    """
+    files: dict[str, Path] = {}
+
+    covers_dir = TARGET_ASSETS / "covers"
+    variant_dir = covers_dir / f"{max(COVER_SCALES)}x"
+    if covers_dir.is_dir():
+        for path in covers_dir.iterdir():
+            if path.is_file() and path.suffix.lower() in PACK_FORMATS and not (variant_dir / path.name).is_file():
+                files[manifest_key(path)] = path
+    if variant_dir.is_dir():
+        for path in variant_dir.iterdir():
+            if path.is_file() and path.suffix.lower() in PACK_FORMATS:
+                files[manifest_key(path)] = path
+
+    atlas_icons: set[str] = set()
+    try:
+        with open(TARGET_ASSETS / "atlas" / "icons.json", encoding="utf-8") as f:
+            atlas_index = json.load(f)
+        atlas_image = TARGET_ASSETS / "atlas" / atlas_index["image"]
+        if atlas_image.is_file():
+            files[manifest_key(atlas_image)] = atlas_image
+            atlas_icons = {f"icons/{icon['file']}" for icon in atlas_index["icons"].values()}
+    except (OSError, ValueError, KeyError):
+        pass
+    try:
+        with open(RUNTIME_INDEX_PATH, encoding="utf-8") as f:
+            runtime_files = json.load(f)["files"]
+    except (OSError, ValueError, KeyError):
+        runtime_files = {}
+
+    runtime_dir = TARGET_ASSETS / "runtime"
+    for dir_name in RUNTIME_TIER_DIRS:
+        source_dir = TARGET_ASSETS / dir_name
+        if not source_dir.is_dir():
+            continue
+        for path in source_dir.iterdir():
+            if not path.is_file() or path.suffix.lower() not in PACK_FORMATS or path.name.startswith("."):
+                continue
+            key = manifest_key(path)
+            if path.suffix.lower() != ".avif":
+                files[key] = path
+                continue
+            if key in atlas_icons:
+                continue
+            candidates = [runtime_dir / Path(key).with_suffix(".png")]
+            if key in runtime_files:
+                candidates.insert(0, runtime_dir / runtime_files[key]["file"])
+            packed = next((candidate for candidate in candidates if candidate.is_file()), path)
+            files[manifest_key(packed)] = packed
+    return dict(sorted(files.items()))
+
+
+def load_pack_index(path: Path) -> dict | None:
+    """读取资源包索引，不存在或格式不符时返回 None"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if index.get("version") != PACK_VERSION:
+        return None
+    return index
+
+
+def pack_assets(alignment: int = PACK_ALIGNMENT) -> int:
+    """
+    把运行时读取的图片打包为 pack/assets.bin + pack/index.json：
+      { "version": 1, "alignment": A, "size": N, "files": { 相对路径: [offset, length, format, sha256] } }
+    条目按路径顺序紧密排列，之间以 0 填充到 alignment 对齐，同样的输入总是得到同样的字节。
+    每次都写出新的 blob 后 os.replace，不改写旧 blob：正在读取它的渲染进程与已发布版本中的硬链接都不受影响。
+    内容未变化时不写，返回写入的字节数
+    """
+    files = collect_pack_files()
+    payloads = {key: path.read_bytes() for key, path in files.items()}
+    lengths = {key: len(data) for key, data in payloads.items()}
+    offsets: dict[str, int] = {}
+    size = 0
+    for key, length in lengths.items():
+        offsets[key] = size
+        size += align_up(length, alignment)
+    index = {
+        "version": PACK_VERSION,
+        "alignment": alignment,
+        "size": size,
+        "files": {
+            key: [offsets[key], lengths[key], PACK_FORMATS[path.suffix.lower()], hashlib.sha256(payloads[key]).hexdigest()]
+            for key, path in files.items()
+        },
+    }
+    if load_pack_index(PACK_INDEX_PATH) == index and PACK_BLOB_PATH.is_file() and PACK_BLOB_PATH.stat().st_size == size:
+        print(f"[B] 资源包未变化: {len(files)} 个文件, {size / 1024 / 1024:.1f}MB")
+        return 0
+
+    PACK_DIR.mkdir(parents=True, exist_ok=True)
+    # 先删除索引：替换 blob 之后、写入新索引之前，运行时找不到索引会回退到逐个文件读取，而不是按旧偏移读新 blob
+    PACK_INDEX_PATH.unlink(missing_ok=True)
+    tmp_path = temporary_path(PACK_BLOB_PATH)
+    with open(tmp_path, "wb") as f:
+        for key in files:
+            f.write(payloads[key] + bytes(align_up(lengths[key], alignment) - lengths[key]))
+    os.replace(tmp_path, PACK_BLOB_PATH)
+    write_output(PACK_INDEX_PATH, json.dumps(index, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+    padding = size - sum(lengths.values())
+    print(f"[B] 资源包已生成: {len(files)} 个文件, {size / 1024 / 1024:.1f}MB（填充 {padding / 1024:.1f}KB）")
+    return size
+
+
+def list_versions(publish_root: Path) -> list[str]:
+    """已发布的版本号，从旧到新（版本号以时间戳开头）"""
+    versions_dir = publish_root / "versions"
+    if not versions_dir.is_dir():
+        return []
+    return sorted(item.name for item in versions_dir.iterdir() if item.is_dir() and not item.name.startswith("."))
+
+
+def current_version(publish_root: Path) -> str | None:
+    current = publish_root / "current"
+    if not current.is_symlink():
+        return None
+    return Path(os.readlink(current)).name
+
+
+def switch_current(publish_root: Path, version: str):
+    """先在旁边建好指向新版本的符号链接，再 os.replace 到 current：读取方总能看到一个完整的版本"""
+    tmp_link = temporary_path(publish_root / "current")
+    tmp_link.unlink(missing_ok=True)
+    os.symlink(Path("versions") / version, tmp_link, target_is_directory=True)
+    os.replace(tmp_link, publish_root / "current")
+
+
+def prune_versions(publish_root: Path, keep: int) -> int:
+    """删除中断残留的暂存目录与超出保留数量的旧版本（当前版本及比它新的版本不删除），返回删除的版本数"""
+    versions_dir = publish_root / "versions"
+    for item in versions_dir.glob(".*.staging"):
+        shutil.rmtree(item, ignore_errors=True)
+    versions = list_versions(publish_root)
+    current = current_version(publish_root)
+    if current not in versions:
+        return 0
+    older = versions[: versions.index(current)]
+    stale = older[: max(len(older) - keep, 0)]
+    for version in stale:
+        shutil.rmtree(versions_dir / version)
+    return len(stale)
+
+
+def publish_version(publish_root: Path, keep: int = DEFAULT_KEEP_VERSIONS) -> int:
+    """
+    把工作目录 TARGET_ASSETS 发布为 publish_root/versions/<版本号>，并原子切换 publish_root/current。
+    快照用硬链接（跨文件系统时复制）。所有输出都以临时文件 + os.replace 写入，工作目录之后的构建只会
+    替换目录项而不会改写已发布的文件。内容与当前版本相同（同一批 inode）时不生成新版本。返回退出码
+    """
+    publish_root = publish_root.resolve()
+    if publish_root.is_relative_to(TARGET_ASSETS.resolve()):
+        # 会被下一次构建当作过期输出清理
+        print(f"[E] 发布目录不能位于 {TARGET_ASSETS} 内: {publish_root}")
+        return 1
+    if publish_root.is_relative_to(BUILD_OUTPUT_DIR.resolve()):
+        print(f"[E] 发布目录不能位于 {BUILD_OUTPUT_DIR} 内（yarn build 会先删除它）: {publish_root}")
+        return 1
+    files = sorted(
+        path
+        for path in TARGET_ASSETS.rglob("*")
+        if path.is_file()
+        and not path.name.endswith(".tmp")
+    )
+    current = current_version(publish_root)
+    if (publish_root / "current").exists() and current is None:
+        print(f"[E] {publish_root / 'current'} 不是符号链接，无法切换")
+        return 1
+
+    if current is not None:
+        current_dir = publish_root / "versions" / current
+        published = sorted(path for path in current_dir.rglob("*") if path.is_file()) if current_dir.is_dir() else []
+        relative = [path.relative_to(TARGET_ASSETS) for path in files]
+        if relative == [path.relative_to(current_dir) for path in published] and all(
+            os.path.samefile(path, current_dir / rel) for path, rel in zip(files, relative)
+        ):
+            removed = prune_versions(publish_root, keep)
+            print(f"[V] 资产未变化，继续使用版本 {current}（清理 {removed} 个旧版本）")
+            return 0
+
+    # 版本号为发布时间，同一秒内多次发布时追加序号
+    timestamp = time.strftime("%Y%m%d-%H%M%S")
+    existing = set(list_versions(publish_root))
+    version, suffix = timestamp, 1
+    while version in existing:
+        suffix += 1
+        version = f"{timestamp}-{suffix}"
+    staging = publish_root / "versions" / f".{version}.staging"
+    if staging.exists():
+        shutil.rmtree(staging)
+    for path in files:
+        link_file(path, staging / path.relative_to(TARGET_ASSETS))
+    staging.mkdir(parents=True, exist_ok=True)
+    os.replace(staging, publish_root / "versions" / version)
+
+    try:
+        switch_current(publish_root, version)
+    except OSError as e:
+        # Windows 上创建符号链接可能需要开发者模式或管理员权限
+        print(f"[E] 无法切换 current 符号链接: {e}")
+        return 1
+    removed = prune_versions(publish_root, keep)
+    print(
+        f"[V] 已发布版本 {version}: {len(files)} 个文件，current -> versions/{version}"
+        f"（上一版本 {current or '无'}，清理 {removed} 个旧版本）"
+    )
+    return 0
+
+
+def rollback_version(publish_root: Path, target: str | None) -> int:
+    """把 current 切换到指定版本，未指定时切换到当前版本的上一个版本。返回退出码"""
+    publish_root = publish_root.resolve()
+    versions = list_versions(publish_root)
+    current = current_version(publish_root)
+    if target is None:
+        older = versions[: versions.index(current)] if current in versions else []
+        if not older:
+            print(f"[E] 没有可回滚的旧版本（当前 {current or '无'}）")
+            return 1
+        target = older[-1]
+    elif target not in versions:
+        print(f"[E] 版本不存在: {target}（可用: {', '.join(versions) or '无'}）")
+        return 1
+    switch_current(publish_root, target)
+    print(f"[V] current -> versions/{target}（原版本 {current or '无'}）")
+    return 0
+
+
+def display_path(path: Path) -> str:
+    """输出路径优先显示为相对 TARGET_ASSETS 的形式"""
+    try:
+        return path.relative_to(TARGET_ASSETS).as_posix()
+    except ValueError:
+        return path.name
+
+
+def report_result(result: TaskResult):
+    """在主进程中输出单个任务结果"""
+    source_name = Path(result.source).name
+    if result.kind == "copy":
+        if result.ok:
+            safe_print(f"[C] 复制: {source_name}")
+        else:
+            safe_print(f"[FAIL] 复制失败 {source_name}: {result.error}")
+        return
+
+    if not result.ok:
+        safe_print(f"[FAIL] 转换失败 {source_name}: {result.error}")
+        return
+
+    if result.kind == "image" and result.fmt == "AUTO":
+        candidates = ", ".join(
+            f"{fmt} {info['bytes'] / 1024:.1f}KB/" + ("淘汰" if info.get("rejected") else f"{info['decode_ms']:.1f}ms")
+            for fmt, info in result.extra["candidates"].items()
+        )
+        safe_print(f"[OK] {source_name} -> {display_path(Path(result.target))} ({result.extra['format']})")
+        safe_print(f"  {candidates}")
+        return
+
+    if result.kind == "font":
+        saved = (result.source_bytes - result.target_bytes) / 1024
+        safe_print(f"[F] {source_name} -> {display_path(Path(result.target))}")
+        safe_print(
+            f"  {result.extra['glyphs_before']} -> {result.extra['glyphs_after']} 字形, "
+            f"{result.source_bytes / 1024:.1f}KB -> {result.target_bytes / 1024:.1f}KB (节省 {saved:.1f}KB)"
+        )
+        return
+
+    source_size = result.source_bytes / 1024
+    target_size = result.target_bytes / 1024
+    reduction = (1 - target_size / source_size) * 100 if source_size > 0 else 0
+    alpha_info = " (with alpha)" if result.has_alpha else ""
+    cache_info = "（缓存命中）" if result.cached else ""
+    safe_print(f"[OK] {source_name} -> {display_path(Path(result.target))}{alpha_info}{cache_info}")
+    safe_print(f"  {source_size:.1f}KB -> {target_size:.1f}KB (减少 {reduction:.1f}%)")
+
+
+def default_workers(executor_kind: str) -> int:
+    """进程池按物理并行度取 CPU 数；线程池沿用原先的 min(32, cpu*2)"""
+    cpu = os.cpu_count() or 4
+    if executor_kind == "process":
+        return cpu
+    return min(32, cpu * 2)
+
+
+def create_executor(executor_kind: str, max_workers: int):
+    """
+    创建任务执行器。
+    Pillow 的解码、convert 与编码大段持有 GIL，线程池只能用上少数核心，
+    因此默认使用进程池；worker 只接收路径与参数，返回 TaskResult。
+    """
+    if executor_kind == "process":
+        return ProcessPoolExecutor(max_workers=max_workers)
+    return ThreadPoolExecutor(max_workers=max_workers)
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="转换 MilResource 的插图资源文件")
+    subparsers = parser.add_subparsers(dest="command")
+    merge_parser = subparsers.add_parser("merge", help="合并 --shard 分片构建的输出，校验后生成最终的 assets 目录")
+    merge_parser.add_argument(
+        "--shards",
+        type=int,
+        default=None,
+        metavar="N",
+        help="期望的分片总数（默认取分片输出中记录的值）",
+    )
+    merge_parser.add_argument("--pack", action="store_true", help="合并后更新资源包（同 pack 子命令）")
+    pack_parser = subparsers.add_parser(
+        "pack", help="把运行时读取的图片打包为 pack/assets.bin + 偏移索引 pack/index.json"
+    )
+    pack_parser.add_argument(
+        "--alignment",
+        type=int,
+        default=PACK_ALIGNMENT,
+        metavar="BYTES",
+        help=f"条目对齐字节数（默认 {PACK_ALIGNMENT}，即一页）",
+    )
+    publish_parser = subparsers.add_parser(
+        "publish", help="把当前 assets 发布为 DIR/versions/<版本号>，并原子切换 DIR/current 符号链接"
+    )
+    publish_parser.add_argument("publish", type=Path, metavar="DIR", help="发布目录（位于 lib 之外，插件配置项 assetsDir 指向它）")
+    publish_parser.add_argument(
+        "--keep-versions",
+        type=int,
+        default=DEFAULT_KEEP_VERSIONS,
+        metavar="N",
+        help=f"除当前版本外保留的旧版本数（默认 {DEFAULT_KEEP_VERSIONS}）",
+    )
+    rollback_parser = subparsers.add_parser("rollback", help="把 DIR/current 切换回之前发布的版本")
+    rollback_parser.add_argument("publish", type=Path, metavar="DIR", help="发布目录")
+    rollback_parser.add_argument("--to", default=None, metavar="VERSION", help="目标版本号（默认上一个版本）")
+    parser.add_argument(
+        "--executor",
+        choices=("process", "thread"),
+        default="process",
+        help="并发后端：process（多进程，默认）或 thread（多线程）",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="并发 worker 数（默认 process 为 CPU 数，thread 为 min(32, CPU*2)）",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=int,
+        default=None,
+        metavar="MB",
+        help="同时运行的任务估算内存占用上限（MB，默认取 cgroup 限制或物理内存的 60%%，0 表示不限制）",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="忽略构建清单，清空生成目录后全部重新转换",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        nargs="?",
+        const=DEFAULT_CACHE_DIR,
+        default=None,
+        metavar="DIR",
+        help=f"启用跨检出目录共享的转换缓存（不带路径时为 {DEFAULT_CACHE_DIR}）",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=DEFAULT_CACHE_SIZE_MB,
+        metavar="MB",
+        help=f"转换缓存的大小上限，超出时按最近使用时间淘汰（默认 {DEFAULT_CACHE_SIZE_MB}MB）",
+    )
+    parser.add_argument(
+        "--pixel-cache",
+        type=Path,
+        nargs="?",
+        const=DEFAULT_PIXEL_CACHE_DIR,
+        default=None,
+        metavar="DIR",
+        help=f"缓存模式处理后的解码像素并以内存映射读取，调整质量或新增变体时不再重复解码（不带路径时为 {DEFAULT_PIXEL_CACHE_DIR}）",
+    )
+    parser.add_argument(
+        "--pixel-cache-size",
+        type=int,
+        default=DEFAULT_PIXEL_CACHE_SIZE_MB,
+        metavar="MB",
+        help=f"像素缓存的大小上限，超出时按最近使用时间淘汰（默认 {DEFAULT_PIXEL_CACHE_SIZE_MB}MB）",
+    )
+    parser.add_argument(
+        "--shard",
+        type=parse_shard,
+        default=None,
+        metavar="K/N",
+        help="只处理按源文件哈希划分的第 K 个分片（共 N 个），输出部分构建清单与 cover-map.json，之后用 merge 子命令合并",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="从上次中断的构建继续：任务日志中已完成的输出不再转换（与 --full 同用时不会再次清空目录）",
+    )
+    parser.add_argument(
+        "--full-covers",
+        action="store_true",
+        help="额外输出全分辨率封面（渲染器只读取卡片尺寸的变体，默认不输出）",
+    )
+    parser.add_argument(
+        "--target-ssim",
+        type=float,
+        default=None,
+        metavar="SSIM",
+        help="封面按图二分搜索 WebP 质量，取渲染尺寸下 SSIM 不低于该值的最低质量（如 0.98），替代固定质量",
+    )
+    parser.add_argument(
+        "--matte",
+        type=parse_matte,
+        default=DEFAULT_MATTE,
+        metavar="COLOR",
+        help="非 PNG 插图带 alpha 时拍平所用的底色，如 #ffffff、black 或 255,255,255（默认白色）",
+    )
+    parser.add_argument(
+        "--dedup",
+        choices=("off", "exact", "perceptual"),
+        default="exact",
+        help="插图去重：exact 按解码后像素（默认），perceptual 额外按 dHash 合并近似重复，off 关闭",
+    )
+    parser.add_argument(
+        "--dedup-threshold",
+        type=int,
+        default=4,
+        help="perceptual 模式下视为重复的 dHash 最大汉明距离（64 位，默认 4）",
+    )
+    parser.add_argument(
+        "--runtime-tier",
+        choices=("none", "png", "rgba", "auto"),
+        default="none",
+        help="额外输出 icons/backgrounds/badges 的运行时层（assets/runtime），AVIF 仍为源文件；"
+        "auto 逐个比较 AVIF/WebP/PNG/PNG8 的体积与解码耗时，选择结果写入 runtime/index.json",
+    )
+    parser.add_argument(
+        "--auto-lambda",
+        type=float,
+        default=None,
+        metavar="BYTES_PER_MS",
+        help="auto 运行时层打分 字节数 + λ × 解码毫秒数 中的 λ（默认按目录：icons/badges 20000，backgrounds 2000）",
+    )
+    parser.add_argument(
+        "--auto-ssim-floor",
+        type=float,
+        default=AUTO_SSIM_FLOOR,
+        metavar="SSIM",
+        help=f"auto 运行时层有损候选（AVIF/WebP/PNG8）逐通道 SSIM 的下限，低于此值不参与选择（默认: {AUTO_SSIM_FLOOR}）",
+    )
+    parser.add_argument(
+        "--subset-fonts",
+        action="store_true",
+        help="按 out.json 歌名与 UI 文本对 assets/fonts 子集化，输出 *.subset.ttf，报告写入 .build/font-subset-report.json",
+    )
+    parser.add_argument(
+        "--font-text-file",
+        type=Path,
+        action="append",
+        default=None,
+        help="子集化额外收录的 UI 文本文件（可重复；默认 src/renderer/image.ts）",
+    )
+    parser.add_argument(
+        "--instance-fonts",
+        action="store_true",
+        help="为 FONT_INSTANCES 中配置的可变字体生成静态实例（*.instance-<axes>.ttf）",
+    )
+    parser.add_argument(
+        "--font-instance",
+        type=parse_axis_values,
+        action="append",
+        default=None,
+        metavar="AXES",
+        help="覆盖默认实例坐标，如 wght=400,BEVL=80（可重复，作用于 FONT_INSTANCES 中的全部字体）",
+    )
+    parser.add_argument(
+        "--icon-atlas",
+        action="store_true",
+        help="把渲染用到的段位、评级与星标图标打包为图集 assets/atlas/icons.png 与坐标索引 icons.json",
+    )
+    parser.add_argument(
+        "--pack",
+        action="store_true",
+        help="构建后增量更新资源包 assets/pack（分片构建时忽略，由 merge --pack 处理）",
+    )
+    parser.add_argument(
+        "--publish",
+        type=Path,
+        default=None,
+        metavar="DIR",
+        help="构建成功后发布为 DIR/versions/<版本号> 并原子切换 DIR/current（分片构建时忽略，merge 后用 publish 子命令）",
+    )
+    parser.add_argument(
+        "--keep-versions",
+        type=int,
+        default=DEFAULT_KEEP_VERSIONS,
+        metavar="N",
+        help=f"--publish 时除当前版本外保留的旧版本数（默认 {DEFAULT_KEEP_VERSIONS}）",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None):
+    args = parse_args(argv)
+    if args.command == "merge":
+        sys.exit(merge_shards(args.shards, args.pack))
+    if args.command == "pack":
+        if args.alignment <= 0:
+            print("[E] --alignment 必须为正整数")
+            sys.exit(2)
+        pack_assets(args.alignment)
+        return
+    if args.command == "publish":
+        sys.exit(publish_version(args.publish, args.keep_versions))
+    if args.command == "rollback":
+        sys.exit(rollback_version(args.publish, args.to))
+    max_workers = args.workers or default_workers(args.executor)
+    build_started = time.perf_counter()
+    phases: dict[str, float] = {}
+
+    print("=" * 60)
+    mode_name = "多进程" if args.executor == "process" else "多线程"
+    print(f"Milthm 资产转换脚本（{mode_name}模式）")
+    print(f"[*] 并发 worker 数: {max_workers}")
+    # 分片构建：图片任务按源文件哈希划分，字体与图集这类单个任务只由第 1 个分片处理
+    shard = args.shard
+    if shard:
+        print(f"[*] 分片: {shard[0]}/{shard[1]}")
+    print("=" * 60)
+
+    def owns(source_path: Path) -> bool:
+        return shard is None or shard_of(source_path, shard[1]) == shard[0]
+
+    owns_singletons = shard is None or shard[0] == 1
+    # 分片的任务日志与构建报告写在各自的分片目录中，避免多个节点同时写同一文件
+    journal_path = JOURNAL_PATH if shard is None else shard_dir(shard) / JOURNAL_PATH.name
+    report_path = BUILD_REPORT_PATH if shard is None else shard_dir(shard) / BUILD_REPORT_PATH.name
+
     # 检查源目录
     illustration_dir = MIL_RESOURCE_ROOT / "illustration"
     out_json_path = MIL_RESOURCE_ROOT / "out.json"
@@ -171,10 +2779,18 @@ def main():
         print(f"[E] 错误: out.json 不存在: {out_json_path}")
         return
 
-    # 清空目标目录（保留 backgrounds 和 icons，因为它们需要被提交）
-    PRESERVE_DIRS = {'backgrounds', 'icons', 'fonts'}
-    if TARGET_ASSETS.exists():
-        print(f"[D]  清空目标目录: {TARGET_ASSETS}（保留 {', '.join(PRESERVE_DIRS)}）")
+    # 调度用的代价模型读取上一次的构建报告，需在清空目标目录之前加载
+    cost_model = CostModel(report_path)
+
+    # 续跑时读取任务日志
+    journal_entries = load_journal(journal_path) if args.resume else {}
+    if args.resume:
+        print(f"[R] 从任务日志恢复: {len(journal_entries)} 个已完成输出")
+
+    # 完整构建时清空目标目录（保留需要提交的目录）；默认按构建清单增量构建
+    # 续跑完整构建时目录中已有上次完成的输出，不再清空；分片构建共享同一目录，由 merge 清理
+    if args.full and shard is None and not journal_entries and TARGET_ASSETS.exists():
+        print(f"[D]  清空目标目录: {TARGET_ASSETS}（保留 {', '.join(sorted(PRESERVE_DIRS))}）")
         for item in TARGET_ASSETS.iterdir():
             if item.name in PRESERVE_DIRS:
                 continue
@@ -184,79 +2800,493 @@ def main():
                 item.unlink()
     TARGET_ASSETS.mkdir(parents=True, exist_ok=True)
 
+    old_manifest = {} if args.full else load_manifest(MANIFEST_PATH)
+    # 日志中的记录比上次的构建清单更新；输出文件是否完好仍由 is_up_to_date 校验
+    old_manifest.update(journal_entries)
+    new_manifest: dict[str, dict] = {}
+
     # 解析 out.json 建立映射
     print("\n[R] 解析 out.json 建立歌名映射...")
-    title_to_png = parse_out_json(out_json_path)
+    songs = parse_songs(out_json_path)
+    title_to_png = map_titles_to_png(songs)
     print(f"  找到 {len(title_to_png)} 首歌曲")
 
     # 收集任务
-    image_tasks: list[tuple] = []   # (source, target, quality, fmt)
+    image_tasks: list[tuple] = []   # (source, target, quality, fmt, size, options)
     copy_tasks: list[tuple] = []    # (source, target)
 
     # cover-map.json: { title → webp_filename }
     cover_map: dict[str, str] = {}
+    # 预缩放变体: { webp_filename → { "1x": 输出路径, "2x": ... } }
+    cover_variant_targets: dict[str, dict[str, Path]] = {}
+    # 每张封面的全部输出（全尺寸封面 + 变体），中断时据此筛选已完成的歌名
+    cover_outputs: dict[str, list[Path]] = {}
+    # 实际存在的插图: { png_filename → webp_filename }
+    webp_by_png: dict[str, str] = {}
 
     covers_target = TARGET_ASSETS / "covers"
     covers_target.mkdir(parents=True, exist_ok=True)
+    queued_targets: set[Path] = set()
+
+    skipped = 0
+
+    def queue_image(
+        source_path: Path,
+        target_path: Path,
+        quality: int,
+        fmt: str,
+        size: tuple[int, int] | None = None,
+        options: dict | None = None,
+    ):
+        """登记一个输出；构建清单显示其未变化时跳过转换"""
+        nonlocal skipped
+        if not owns(source_path):
+            return
+        queued_targets.add(target_path)
+        key = manifest_key(target_path)
+        entry = old_manifest.get(key)
+        if is_up_to_date(entry, source_path, target_path, quality, fmt, size, options):
+            new_manifest[key] = entry  # type: ignore[assignment]
+            skipped += 1
+        else:
+            image_tasks.append((source_path, target_path, quality, fmt, size, options))
+
+    # 内存准入：指纹计算与转换任务都按估算占用之和不超过预算提交
+    if args.memory_budget is None:
+        memory = available_memory()
+        memory_budget = int(memory * DEFAULT_MEMORY_BUDGET_FRACTION) if memory else 0
+    else:
+        memory_budget = args.memory_budget * 1024 * 1024
+    if memory_budget:
+        print(f"[M] 内存预算: {memory_budget / 1024 / 1024:.0f}MB")
+    admission = MemoryAdmission(memory_budget)
 
+    # 插图去重：像素相同（perceptual 模式下 dHash 相近）的插图只编码代表文件一次，其余作为别名
+    old_fingerprints = {} if args.full else load_manifest(MANIFEST_PATH, "fingerprints")
+    new_fingerprints: dict[str, dict] = {}
+    canonical_png: dict[str, str] = {}
+    if args.dedup != "off":
+        sources = {
+            png_filename: illustration_dir / png_filename
+            for png_filename in dict.fromkeys(title_to_png.values())
+            if (illustration_dir / png_filename).exists()
+        }
+        perceptual = args.dedup == "perceptual"
+        phase_started = time.perf_counter()
+        fingerprints = fingerprint_sources(
+            sources, old_fingerprints, new_fingerprints, perceptual, args.executor, max_workers, cost_model, admission
+        )
+        phases["fingerprint"] = time.perf_counter() - phase_started
+        canonical_png = group_duplicates(fingerprints, args.dedup_threshold if perceptual else None)
+        aliases = sum(1 for name, canonical in canonical_png.items() if name != canonical)
+        print(f"\n[H] 插图去重: {len(sources)} 张插图中 {aliases} 张为重复，作为别名写入封面映射")
+    else:
+        new_fingerprints = dict(old_fingerprints)
+
+    # 按 SSIM 搜索质量时，选中的质量记录在清单的 extra 中，目标不变时增量构建直接跳过
+    # 非默认底色同样记入 options，修改 --matte 后会重新转换
+    cover_settings: dict = {}
+    if args.target_ssim is not None:
+        cover_settings["target_ssim"] = args.target_ssim
+    if args.matte != DEFAULT_MATTE:
+        cover_settings["matte"] = list(args.matte)
+    cover_options = cover_settings or None
     for title, png_filename in title_to_png.items():
         source_path = illustration_dir / png_filename
         if not source_path.exists():
             safe_print(f"[W]  找不到插图: {png_filename} (歌曲: {title})")
             continue
 
+        # 重复插图改用组内代表文件
+        canonical = canonical_png.get(png_filename, png_filename)
+        source_path = illustration_dir / canonical
+
         # 用原始 PNG 文件名 stem 作为 WebP 文件名，保持与 MilResource 的映射一致
-        webp_filename = Path(png_filename).stem + ".webp"
+        webp_filename = Path(canonical).stem + ".webp"
 
         target_path = covers_target / webp_filename
-        image_tasks.append((source_path, target_path, 65, "WEBP"))
+        # 多个歌名可能共用同一张插图，只提交一次，避免多个 worker 同时写同一文件
+        if webp_filename not in cover_variant_targets:
+            if args.full_covers:
+                queue_image(source_path, target_path, COVER_QUALITY, "WEBP", options=cover_options)
+            # 预缩放到卡片尺寸的变体：covers/{scale}x/{webp_filename}
+            variants: dict[str, Path] = {}
+            for scale in COVER_SCALES:
+                variant_size = (COVER_SIZE[0] * scale, COVER_SIZE[1] * scale)
+                variant_path = covers_target / f"{scale}x" / webp_filename
+                # 最小的变体顺带生成占位缩略图（尺寸记入 options，修改后会重新生成）
+                variant_options = cover_options
+                if scale == min(COVER_SCALES):
+                    variant_options = {**cover_settings, "placeholder": list(PLACEHOLDER_SIZE)}
+                queue_image(source_path, variant_path, COVER_VARIANT_QUALITY, "WEBP", variant_size, variant_options)
+                variants[f"{scale}x"] = variant_path
+            cover_variant_targets[webp_filename] = variants
+            cover_outputs[webp_filename] = ([target_path] if args.full_covers else []) + list(variants.values())
+        webp_by_png[png_filename] = webp_filename
         cover_map[title] = webp_filename
 
-    # 收集字体文件（字体直接提交到 git，无需 convert 脚本处理）
+    # 运行时层：预解码提交的 icons/backgrounds/badges
+    runtime_count = 0
+    if args.runtime_tier != "none":
+        runtime_fmt = args.runtime_tier.upper()
+        runtime_target = TARGET_ASSETS / "runtime"
+        for dir_name in RUNTIME_TIER_DIRS:
+            source_dir = TARGET_ASSETS / dir_name
+            if not source_dir.is_dir():
+                continue
+            for source_path in sorted(source_dir.iterdir()):
+                if source_path.suffix.lower() not in RUNTIME_TIER_SOURCE_SUFFIXES:
+                    continue
+                if runtime_fmt == "AUTO":
+                    # 输出扩展名取决于选中的格式：沿用上次选中的文件判断是否需要重新评估，首次构建时用占位路径
+                    stem_path = runtime_target / dir_name / source_path.stem
+                    target_path = next(
+                        (
+                            candidate
+                            for candidate in (
+                                stem_path.with_name(stem_path.name + extension)
+                                for extension in dict.fromkeys(AUTO_EXTENSIONS.values())
+                            )
+                            if manifest_key(candidate) in old_manifest
+                        ),
+                        stem_path.with_name(stem_path.name + ".auto"),
+                    )
+                    weight = args.auto_lambda if args.auto_lambda is not None else AUTO_LAMBDA[dir_name]
+                    queue_image(
+                        source_path,
+                        target_path,
+                        0,
+                        runtime_fmt,
+                        options={"lambda": weight, "ssim_floor": args.auto_ssim_floor},
+                    )
+                else:
+                    target_path = runtime_target / dir_name / (source_path.stem + "." + runtime_fmt.lower())
+                    queue_image(source_path, target_path, 0, runtime_fmt)
+                runtime_count += 1
+
+    # 可变字体实例化（输出在原字体旁）
+    instance_tasks: list[tuple] = []  # (source, target, axes)
+    instance_axes: dict[Path, list[dict[str, float]]] = {}  # 源字体 → 各实例坐标，子集化据此裁剪实例
+    if args.instance_fonts and owns_singletons:
+        for relative_path, default_instances in FONT_INSTANCES.items():
+            source_path = FONTS_DIR / relative_path
+            if not source_path.exists():
+                safe_print(f"[W]  找不到可变字体: {relative_path}")
+                continue
+            instance_axes[source_path] = list(args.font_instance or default_instances)
+            for axes in instance_axes[source_path]:
+                target_path = font_instance_path(source_path, axes)
+                instance_options = {"axes": dict(sorted(axes.items()))}
+                entry = old_manifest.get(manifest_key(target_path))
+                queued_targets.add(target_path)
+                if is_up_to_date(entry, source_path, target_path, 0, "INSTANCE", options=instance_options):
+                    new_manifest[manifest_key(target_path)] = entry  # type: ignore[assignment]
+                    skipped += 1
+                else:
+                    instance_tasks.append((source_path, target_path, axes))
+
+    # 字体子集化（原字体直接提交到 git，子集输出在原字体旁）。
+    # 生成了静态实例的字体只裁剪实例：渲染器加载的是实例，不再加载可变的原字体
+    font_tasks: list[tuple] = []  # (source, target, text, axes)
+    font_options: dict | None = None
+    font_outputs: list[Path] = []
+    if args.subset_fonts and owns_singletons:
+        text_files = args.font_text_file or [p for p in DEFAULT_FONT_TEXT_FILES if p.exists()]
+        font_text = collect_font_text(list(title_to_png), text_files)
+        font_options = {
+            "text_hash": hashlib.sha256(font_text.encode("utf-8")).hexdigest(),
+            "family_suffix": FONT_SUBSET_FAMILY_SUFFIX,
+        }
+        print(f"\n[F] 子集化字符集: {len(font_text)} 个字符")
+        for source_path in sorted(FONTS_DIR.rglob("*")):
+            if source_path.suffix.lower() not in FONT_SOURCE_SUFFIXES or is_generated_font(source_path):
+                continue
+            for axes in instance_axes.get(source_path) or [None]:
+                font_path = font_instance_path(source_path, axes) if axes else source_path
+                target_path = font_subset_path(font_path)
+                subset_options = dict(font_options, axes=dict(sorted(axes.items()))) if axes else font_options
+                font_outputs.append(target_path)
+                queued_targets.add(target_path)
+                entry = old_manifest.get(manifest_key(target_path))
+                if is_up_to_date(entry, source_path, target_path, 0, "SUBSET", options=subset_options):
+                    new_manifest[manifest_key(target_path)] = entry  # type: ignore[assignment]
+                    skipped += 1
+                else:
+                    font_tasks.append((source_path, target_path, font_text, axes))
 
     total_images = len(image_tasks)
     total_copies = len(copy_tasks)
 
-    print(f"\n[S] 待处理: {total_images} 张图片, {total_copies} 个文件")
+    total_fonts = len(font_tasks) + len(instance_tasks)
+    print(
+        f"\n[S] 待处理: {total_images} 张图片, {total_fonts} 个字体, {total_copies} 个文件（{skipped} 个未变化，跳过）"
+    )
     print("-" * 60)
 
-    # 并行执行
-    counter = {"done": 0}
-    counter_lock = threading.Lock()
+    # 并行执行（结果在主进程中统一输出）
+    done = 0
+    failed = 0
+    results: list[TaskResult] = []
+    # auto 运行时层的 worker 结果：(结果, 写入构建清单时的附加参数)，全部转换结束后再选择格式
+    auto_results: list[tuple[TaskResult, dict]] = []
+    phase_started = time.perf_counter()
 
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        img_futures = {
-            executor.submit(convert_image, src, dst, q, fmt): src
-            for src, dst, q, fmt in image_tasks
-        }
-        copy_futures = {
-            executor.submit(copy_file, src, dst): src
-            for src, dst in copy_tasks
+    # 组装作业：(种类, worker 函数, 参数, 写入构建清单时的附加参数)
+    # 同一源图的各尺寸封面合为一个作业（见 convert_outputs），附加参数为 {"outputs": [(目标, 附加参数), ...]}
+    jobs: list[tuple] = []
+    cover_jobs: dict[tuple, tuple[list, list]] = {}
+    for src, dst, q, fmt, size, options in image_tasks:
+        if fmt in ("PNG", "RGBA"):
+            jobs.append(("image", write_runtime_image, (src, dst, fmt), {"size": size}))
+        elif fmt == "AUTO":
+            auto_args = (src, dst.with_suffix(""), options["ssim_floor"])
+            jobs.append(("image", encode_auto_candidates, auto_args, {"options": options}))
+        else:
+            target_ssim = options.get("target_ssim") if options else None
+            matte = tuple(options["matte"]) if options and "matte" in options else DEFAULT_MATTE
+            placeholder = bool(options and "placeholder" in options)
+            outputs, record_outputs = cover_jobs.setdefault((src, fmt, matte), ([], []))
+            outputs.append((dst, q, size, target_ssim, placeholder))
+            record_outputs.append((dst, {"size": size, "options": options}))
+    for (src, fmt, matte), (outputs, record_outputs) in cover_jobs.items():
+        fn_args = (src, outputs, fmt, args.cache_dir, args.pixel_cache, matte)
+        jobs.append(("image", convert_outputs, fn_args, {"outputs": record_outputs}))
+    for src, dst in copy_tasks:
+        jobs.append(("copy", copy_file, (src, dst), {}))
+    for src, dst, text, axes in font_tasks:
+        subset_options = dict(font_options, axes=dict(sorted(axes.items()))) if axes else font_options
+        jobs.append(("font", subset_font, (src, dst, text, axes), {"options": subset_options}))
+    for src, dst, axes in instance_tasks:
+        jobs.append(("font", instantiate_font, (src, dst, axes), {"options": {"axes": dict(sorted(axes.items()))}}))
+
+    # 最长任务优先：避免大图排在队尾时只剩一个 worker 在忙
+    def job_cost(job: tuple) -> float:
+        kind, fn, fn_args, record_kwargs = job
+        return sum(
+            cost_model.estimate(kind, fn_args[0], target, output_kwargs.get("size"))
+            for target, output_kwargs in job_outputs(job)
+        )
+
+    scheduled = sorted(
+        ((job_cost(job), job) for job in jobs), key=lambda item: (-item[0], str(job_outputs(item[1])[0][0]))
+    )
+    remaining_cost = sum(cost for cost, _ in scheduled)
+    if scheduled:
+        longest_cost, longest_job = scheduled[0]
+        critical_path = lpt_makespan([cost for cost, _ in scheduled], max_workers)
+        print(
+            f"[P] 预计关键路径: {critical_path:.1f}s（共 {remaining_cost:.1f}s 工作量，"
+            f"最长任务 {display_path(job_outputs(longest_job)[0][0])} {longest_cost:.1f}s）"
+        )
+
+    pending = [
+        (estimate_memory(cost_model, kind, fn_args[0]), fn, fn_args, (kind, fn, fn_args, record_kwargs, cost))
+        for cost, (kind, fn, fn_args, record_kwargs) in scheduled
+    ]
+    total = len(pending)
+
+    journal = BuildJournal(journal_path, resume=bool(journal_entries))
+    signal.signal(signal.SIGTERM, raise_interrupt)
+    cover_map_path = covers_target / "cover-map.json" if shard is None else shard_dir(shard) / "cover-map.json"
+
+    try:
+        with create_executor(args.executor, max_workers) as executor:
+            # 按 LPT 顺序准入
+            for (kind, fn, fn_args, record_kwargs, cost), future in admission.run(executor, pending, max_workers):
+                outputs = job_outputs((kind, fn, fn_args, record_kwargs))
+                try:
+                    job_results = future.result()
+                except Exception as e:
+                    # worker 进程异常退出等情况
+                    job_results = [
+                        TaskResult(kind, str(fn_args[0]), str(target), ok=False, error=str(e)) for target, _ in outputs
+                    ]
+                if isinstance(job_results, TaskResult):
+                    job_results = [job_results]
+                for result, (_, output_kwargs) in zip(job_results, outputs):
+                    if result.ok and result.fmt == "AUTO":
+                        # 格式在全部转换结束后才选出，之后再输出结果、写入清单
+                        auto_results.append((result, output_kwargs))
+                        continue
+                    report_result(result)
+                    results.append(result)
+                    if not result.ok:
+                        failed += 1
+                    elif result.kind in ("image", "font"):
+                        queued_targets.add(Path(result.target))
+                        key = record_output(new_manifest, result, **output_kwargs)
+                        journal.record(key, new_manifest[key])
+                done += 1
+                remaining_cost -= cost
+                if done % 20 == 0 or done == total:
+                    elapsed = time.perf_counter() - phase_started
+                    safe_print(
+                        f"  [..] 进度: {done}/{total}（已用 {elapsed:.1f}s，"
+                        f"预计剩余 {max(0.0, remaining_cost) / max_workers:.1f}s）"
+                    )
+
+        # auto 运行时层：所有 worker 都已退出，逐个测量候选的解码耗时，选择结果不受并行调度影响
+        if auto_results:
+            auto_started = time.perf_counter()
+            for result, output_kwargs in auto_results:
+                choose_auto_candidate(result, output_kwargs["options"]["lambda"])
+                report_result(result)
+                results.append(result)
+                if not result.ok:
+                    failed += 1
+                    continue
+                # auto 模式的实际输出路径在选出格式后才确定
+                queued_targets.add(Path(result.target))
+                key = record_output(new_manifest, result, **output_kwargs)
+                journal.record(key, new_manifest[key])
+            shutil.rmtree(AUTO_CANDIDATES_DIR, ignore_errors=True)
+            phases["auto"] = time.perf_counter() - auto_started
+            print(f"[R] auto 运行时层: 串行测量 {len(auto_results)} 个资源的解码耗时，用时 {phases['auto']:.1f}s")
+    except KeyboardInterrupt:
+        # 已完成的输出都在任务日志中；写出只含已完成封面的 cover-map.json，使中断后的目录仍可使用
+        journal.close()
+        partial_map = completed_cover_map(cover_map, cover_outputs, new_manifest)
+        write_json(cover_map_path, partial_map, ensure_ascii=False, indent=2)
+        print(
+            f"\n[W] 构建已中断: 完成 {done}/{total} 个任务，cover-map.json 暂含 {len(partial_map)}/{len(cover_map)} 条映射"
+        )
+        print("请使用 --resume 继续构建")
+        sys.exit(130)
+    if admission.throttled:
+        print(f"[M] 内存预算不足，共 {admission.throttled} 个任务曾被暂缓提交")
+    if args.cache_dir is not None:
+        cache_hits = sum(1 for result in results if result.cached)
+        cache_bytes, evicted = evict_cache(args.cache_dir / "objects", args.cache_size * 1024 * 1024)
+        print(
+            f"[K] 转换缓存: 命中 {cache_hits}/{len(results)}, 占用 {cache_bytes / 1024 / 1024:.1f}MB，"
+            f"淘汰 {evicted} 个"
+        )
+    if args.pixel_cache is not None:
+        pixel_hits = sum(1 for result in results if "pixels" in result.timings)
+        pixel_bytes, evicted = evict_cache(args.pixel_cache, args.pixel_cache_size * 1024 * 1024)
+        print(
+            f"[K] 像素缓存: 命中 {pixel_hits}/{len(results)}, 占用 {pixel_bytes / 1024 / 1024:.1f}MB，"
+            f"淘汰 {evicted} 个"
+        )
+    phases["convert"] = time.perf_counter() - phase_started - phases.get("auto", 0.0)
+
+    # 图标图集（图标数量少，直接在主进程中构建）
+    atlas_targets: set[Path] = set()
+    if args.icon_atlas and owns_singletons:
+        atlas_image = TARGET_ASSETS / "atlas" / "icons.png"
+        atlas_index = TARGET_ASSETS / "atlas" / "icons.json"
+        atlas_result = build_icon_atlas(TARGET_ASSETS / "icons", atlas_image, atlas_index)
+        if atlas_result.ok:
+            atlas_targets = {atlas_image, atlas_index}
+            print(f"\n[A] 图标图集已生成: {atlas_result.width}x{atlas_result.height}, {atlas_result.target_bytes / 1024:.1f}KB")
+        else:
+            failed += 1
+            print(f"\n[FAIL] 图标图集生成失败: {atlas_result.error}")
+
+    # 字体子集化报告
+    if args.subset_fonts and owns_singletons:
+        report = write_font_subset_report(font_outputs, new_manifest)
+        print(f"\n[F] 字体子集化报告已生成: 共节省 {report['bytes_saved'] / 1024 / 1024:.1f}MB")
+
+    if shard is not None:
+        # 分片只写出自己负责的部分，最终的 cover-map.json / cover-index.json / 构建清单由 merge 生成
+        owned = {webp_filename for webp_filename, targets in cover_outputs.items() if targets[0] in queued_targets}
+        shard_map = {title: webp_filename for title, webp_filename in cover_map.items() if webp_filename in owned}
+        write_json(cover_map_path, shard_map, ensure_ascii=False, indent=2)
+        shard_info = {
+            "version": MANIFEST_VERSION,
+            "shard": shard[0],
+            "shards": shard[1],
+            "webp_by_png": {png: webp for png, webp in webp_by_png.items() if webp in owned},
+            "variants": {
+                webp_filename: {scale: manifest_key(path) for scale, path in variants.items()}
+                for webp_filename, variants in cover_variant_targets.items()
+                if webp_filename in owned
+            },
+            "covers": {
+                webp_filename: [manifest_key(path) for path in targets]
+                for webp_filename, targets in cover_outputs.items()
+                if webp_filename in owned
+            },
+            "generated": sorted(manifest_key(path) for path in atlas_targets),
         }
+        write_json(shard_dir(shard) / "shard.json", shard_info, ensure_ascii=False, indent=2)
+        save_manifest(shard_dir(shard) / MANIFEST_PATH.name, new_manifest, new_fingerprints)
+        journal.discard()
+        print(
+            f"\n[J] 分片 {shard[0]}/{shard[1]} 已写入 {display_path(shard_dir(shard))}: "
+            f"{len(new_manifest)} 条记录, {len(shard_map)} 条映射"
+        )
+    else:
+        # 写入 cover-map.json
+        write_json(cover_map_path, cover_map, ensure_ascii=False, indent=2)
+        print(f"\n[J] cover-map.json 已生成: {len(cover_map)} 条映射")
+
+        # 写入 cover-index.json（BeatmapId / 歌名 → 封面 id → 文件与尺寸，rolldown 与 image.ts 共用）
+        cover_index = build_cover_index(songs, webp_by_png, cover_variant_targets, new_manifest)
+        cover_index_path = covers_target / "cover-index.json"
+        write_json(cover_index_path, cover_index, ensure_ascii=False, separators=(",", ":"))
+        print(
+            f"[J] cover-index.json 已生成: {len(cover_index['covers'])} 张封面, "
+            f"{len(cover_index['charts'])} 个谱面, {len(cover_index['titles'])} 个歌名"
+        )
 
-        all_futures = {**img_futures, **copy_futures}
-        total = len(all_futures)
+        placeholder_index_path = write_placeholder_index(cover_variant_targets, new_manifest)
+        print(f"[J] placeholders.json 已生成: {placeholder_index_path.stat().st_size / 1024:.1f}KB")
+
+        runtime_index_path = write_runtime_index(new_manifest)
+        if runtime_index_path:
+            print("[J] runtime/index.json 已生成")
+
+        # 删除不再被任何歌曲引用的旧输出，并写入构建清单
+        keep = queued_targets | atlas_targets | {
+            cover_map_path,
+            cover_index_path,
+            placeholder_index_path,
+        }
+        if runtime_index_path:
+            keep.add(runtime_index_path)
+        # 不更新资源包时旧资源包已过期，随过期文件一起删除
+        if args.pack:
+            keep |= {PACK_BLOB_PATH, PACK_INDEX_PATH}
+        removed = remove_orphans(keep)
+        save_manifest(MANIFEST_PATH, new_manifest, new_fingerprints)
+        journal.discard()
+        print(f"[J] 构建清单已更新: {len(new_manifest)} 条记录，清理 {removed} 个过期文件")
+        if args.pack:
+            pack_assets()
 
-        for future in as_completed(all_futures):
-            with counter_lock:
-                counter["done"] += 1
-                done = counter["done"]
-            if done % 20 == 0 or done == total:
-                safe_print(f"  [..] 进度: {done}/{total}")
+    # 写入 build-report.json（逐文件各阶段耗时与整体统计，用于跟踪构建性能回归）
+    report = build_report(
+        results, time.perf_counter() - build_started, args.executor, max_workers, skipped, phases
+    )
+    write_json(report_path, report, ensure_ascii=False, indent=2)
+    print(
+        f"[J] build-report.json 已生成: {report['tasks']} 个任务, "
+        f"worker 利用率 {report['worker_utilization'] * 100:.1f}%"
+    )
 
-    # 写入 cover-map.json
-    cover_map_path = covers_target / "cover-map.json"
-    with open(cover_map_path, "w", encoding="utf-8") as f:
-        json.dump(cover_map, f, ensure_ascii=False, indent=2)
-    print(f"\n[J] cover-map.json 已生成: {len(cover_map)} 条映射")
+    # 发布：有失败任务时不切换，继续提供上一个完整的版本
+    if args.publish is not None and shard is None:
+        if failed:
+            print(f"[W] 有 {failed} 个任务失败，未发布新版本")
+        elif publish_version(args.publish, args.keep_versions):
+            failed += 1
 
     print("\n" + "=" * 60)
     print("转换完成!")
     print("=" * 60)
     print("[S] 统计:")
-    print(f"  图片: {total_images} 个")
+    print(f"  图片: {total_images} 个（跳过 {skipped} 个）")
+    print(f"  字体: {total_fonts} 个")
     print(f"  文件: {total_copies} 个")
+    print(f"  失败: {failed} 个")
+    dropped = sum(1 for result in results if result.alpha == "dropped")
+    if dropped:
+        print(f"  alpha: {dropped} 张 PNG 全不透明，按 RGB 编码")
     print(f"  封面映射: {len(cover_map)} 条")
+    if runtime_count:
+        print(f"  运行时层: {runtime_count} 个（{args.runtime_tier}）")
     print(f"[DONE] 资产已保存到: {TARGET_ASSETS}")
 
 
@@ -1,7 +1,15 @@
 import { defineConfig } from 'rolldown';
 import pkg from './package.json' with { type: 'json' };
 import { dts } from 'rolldown-plugin-dts';
-import { copyFileSync, mkdirSync, readdirSync, existsSync, readFileSync } from 'node:fs';
+import {
+  copyFileSync,
+  mkdirSync,
+  readdirSync,
+  existsSync,
+  readFileSync,
+  renameSync,
+  rmSync
+} from 'node:fs';
 import { join, dirname, resolve } from 'node:path';
 
 const external = new RegExp(
@@ -19,6 +27,7 @@ const UPSTREAM_CONSTANT_JS = resolve('./third_party/milthm-calculator-web/js/con
 const VIRTUAL_COVERS_ID = 'virtual:milthm-covers';
 const RESOLVED_COVERS_ID = `\0${VIRTUAL_COVERS_ID}`;
 const UPSTREAM_OUT_JSON = resolve('./third_party/MilResource/resource/out.json');
+const COVER_INDEX_JSON = resolve('./assets/covers/cover-index.json');
 
 /**
  * 在构建期间执行上游 constant.js，将 constantsData 序列化为 JSON
@@ -56,8 +65,9 @@ const milthmConstantsPlugin = {
 };
 
 /**
- * 在构建期间解析 out.json，将 BeatmapId → WebP文件名 映射序列化为 JSON
+ * 在构建期间生成 BeatmapId → WebP文件名 映射，序列化为 JSON
  * 并作为虚拟 ESM 模块捆绑进产物，运行时直接用 chart_id 查找封面。
+ * 优先读取 convert_milthm_assets.py 生成的 cover-index.json，不存在时回退到解析 out.json。
  */
 const milthmCoversPlugin = {
   name: 'milthm-covers',
@@ -67,6 +77,21 @@ const milthmCoversPlugin = {
   load(id) {
     if (id !== RESOLVED_COVERS_ID) return;
 
+    if (existsSync(COVER_INDEX_JSON)) {
+      const index = JSON.parse(readFileSync(COVER_INDEX_JSON, 'utf-8'));
+      const coverMap = {};
+      for (const [beatmapId, coverId] of Object.entries(index.charts ?? {})) {
+        const cover = index.covers?.[coverId];
+        if (cover) coverMap[beatmapId] = cover.file;
+      }
+
+      console.log(
+        `\u2713 milthm-covers: 已从 cover-index.json 捆绑 ${Object.keys(coverMap).length} 条封面映射`
+      );
+
+      return `export default ${JSON.stringify(coverMap)}`;
+    }
+
     if (!existsSync(UPSTREAM_OUT_JSON)) {
       console.warn(`[milthm-covers] 找不到 out.json: ${UPSTREAM_OUT_JSON}，封面映射将为空`);
       return `export default {}`;
@@ -97,18 +122,27 @@ const milthmCoversPlugin = {
   }
 };
 
+/**
+ * 把 assets 复制到 lib/assets：先复制到暂存目录再整体替换，不会留下半新半旧的目录。
+ * lib 每次构建都会被清空，版本化发布（convert_milthm_assets.py publish）应放在 lib 之外，
+ * 由插件配置项 assetsDir 指向。
+ */
 const copyAssetsPlugin = {
   name: 'copy-assets',
   buildEnd() {
     const assetsSourceDir = './assets';
     const assetsTargetDir = './lib/assets';
+    const assetsStagingDir = './lib/.assets.staging';
 
     if (!existsSync(assetsSourceDir)) {
       console.log('⚠️  assets 目录不存在，跳过复制');
       console.log('   请先运行: yarn convert');
     } else {
       try {
-        copyDir(assetsSourceDir, assetsTargetDir);
+        rmSync(assetsStagingDir, { recursive: true, force: true });
+        copyDir(assetsSourceDir, assetsStagingDir);
+        rmSync(assetsTargetDir, { recursive: true, force: true });
+        renameSync(assetsStagingDir, assetsTargetDir);
         console.log('✓ Assets 已复制到 lib/');
       } catch (err) {
         console.error('✗ 复制 assets 失败:', err);
@@ -8,6 +8,7 @@ export interface Config {
   pollTimeout: number;
   pollInterval: number;
   isLog: boolean;
+  assetsDir: string;
 }
 
 export const Config: Schema<Config> = Schema.object({
@@ -22,7 +23,11 @@ export const Config: Schema<Config> = Schema.object({
 
   pollInterval: Schema.number().default(5).description('授权轮询间隔（秒）'),
 
-  isLog: Schema.boolean().default(false).description('是否输出 debug 日志')
+  isLog: Schema.boolean().default(false).description('是否输出 debug 日志'),
+
+  assetsDir: Schema.string()
+    .default('')
+    .description('资源发布目录（convert_milthm_assets.py publish 的 DIR），留空时使用插件自带的资源')
 }).i18n(schemaI18n);
 
 export const name = 'milthm-profiler';
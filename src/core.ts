@@ -148,7 +148,7 @@ export async function initClients(ctx: Context, config: Config) {
 
   sessionManager = new SessionManager();
 
-  setB20AssetsPath(__dirname);
+  setB20AssetsPath(__dirname, config.assetsDir ? path.resolve(ctx.baseDir, config.assetsDir) : '');
 
   logger.info('API 客户端初始化完成');
 }
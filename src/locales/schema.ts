@@ -4,20 +4,25 @@ export const schemaI18n = {
     'nyaProfiler.apiKey': 'Re Nya Profiler 的 API Key（从 https://renya.mhtlim.top/ 中获取）',
     pollTimeout: '授权轮询超时时间（秒）',
     pollInterval: '授权轮询间隔（秒）',
-    isLog: '是否输出 debug 日志'
+    isLog: '是否输出 debug 日志',
+    assetsDir: '资源发布目录（convert_milthm_assets.py publish 的 DIR），留空时使用插件自带的资源'
   },
   'en-US': {
     nyaProfiler: { $description: 'Re Nya Profiler API Configuration' },
     'nyaProfiler.apiKey': 'Re Nya Profiler API Key (get from https://renya.mhtlim.top/)',
     pollTimeout: 'Auth polling timeout (seconds)',
     pollInterval: 'Auth polling interval (seconds)',
-    isLog: 'Enable debug logging'
+    isLog: 'Enable debug logging',
+    assetsDir:
+      'Published assets directory (DIR of convert_milthm_assets.py publish). Leave empty to use the bundled assets'
   },
   'ja-JP': {
     nyaProfiler: { $description: 'Re Nya Profiler API 設定' },
     'nyaProfiler.apiKey': 'Re Nya Profiler の API キー（https://renya.mhtlim.top/ から取得）',
     pollTimeout: '認証ポーリングタイムアウト（秒）',
     pollInterval: '認証ポーリング間隔（秒）',
-    isLog: 'デバッグログを有効にする'
+    isLog: 'デバッグログを有効にする',
+    assetsDir:
+      'アセット公開ディレクトリ（convert_milthm_assets.py publish の DIR）。空欄の場合は同梱のアセットを使用'
   }
 };
@@ -37,15 +37,62 @@ export interface B20UserInfo {
 }
 
 let assetsPath = '';
+// Publish root of convert_milthm_assets.py publish (config assetsDir), outside lib/ so builds
+// keep it; empty when nothing is published
+let publishRoot = '';
+// The bundled assets/ or, when published, the version <publishRoot>/current points to
+let assetRoot = '';
 let vipsInstance: any = null;
 let renderSequence = 0;
 let fontCache: Uint8Array[] | null = null;
 let illustrationMapPromise: Promise<Map<string, string>> | null = null;
+let runtimeIndexPromise: Promise<RuntimeIndex['files']> | null = null;
+let placeholderPromise: Promise<Map<string, Uint8Array>> | null = null;
+let assetPackPromise: Promise<AssetPack | null> | null = null;
+// inode/mtime of pack/index.json and pack/assets.bin when the pack was loaded
+let assetPackStamp = '';
+let iconAtlasPromise: Promise<Map<string, Uint8Array>> | null = null;
 
 const pngCache = new Map<string, Uint8Array>();
 
-export function setB20AssetsPath(dirname: string) {
+export function setB20AssetsPath(dirname: string, publishDir = '') {
   assetsPath = dirname;
+  publishRoot = publishDir;
+  assetRoot = path.join(dirname, 'assets');
+}
+
+// Follow <publishRoot>/current (convert_milthm_assets.py publish) once per render. When it was
+// switched to another version, or the pack in it was rebuilt, drop everything cached from the
+// old one. Without a publish root the bundled assets/ is used as is, with no lookup.
+async function refreshAssetRoot() {
+  let root = path.join(assetsPath, 'assets');
+  if (publishRoot) {
+    try {
+      root = await fs.realpath(path.join(publishRoot, 'current'));
+    } catch {
+      // nothing published yet, read the bundled assets/ directly
+    }
+  }
+  if (
+    root === assetRoot &&
+    (!assetPackPromise || (await assetPackFileStamp()) === assetPackStamp)
+  ) {
+    return;
+  }
+  assetRoot = root;
+  pngCache.clear();
+  fontCache = null;
+  illustrationMapPromise = null;
+  runtimeIndexPromise = null;
+  placeholderPromise = null;
+  iconAtlasPromise = null;
+  const oldPack = assetPackPromise;
+  assetPackPromise = null;
+  // Renders already in flight may still read from the old pack; its blob is replaced, never
+  // rewritten
+  setTimeout(() => {
+    oldPack?.then((pack) => pack?.handle.close()).catch(() => {});
+  }, 60_000).unref();
 }
 
 async function initVips() {
@@ -56,6 +103,36 @@ async function initVips() {
   return vipsInstance;
 }
 
+// Font files for one family, in fallback order: the glyph subset (convert_milthm_assets.py
+// --subset-fonts) only covers song titles and UI text, so the full font follows it for user
+// names and other dynamic text. The full font is a static instance (--instance-fonts) when
+// there is one, else the original; the subset is cut from that same font.
+async function resolveFontPaths(dir: string, file: string): Promise<string[]> {
+  const fontDir = path.join(assetRoot, 'fonts', dir);
+  const ext = path.extname(file);
+  const stem = path.basename(file, ext);
+  const paths: string[] = [];
+  let full = file;
+  try {
+    const names = await fs.readdir(fontDir);
+    const instance = names
+      .filter(
+        (name) =>
+          name.startsWith(`${stem}.instance-`) &&
+          name.endsWith(ext) &&
+          !name.endsWith(`.subset${ext}`)
+      )
+      .sort()[0];
+    if (instance) full = instance;
+    const subset = `${path.basename(full, ext)}.subset${ext}`;
+    if (names.includes(subset)) paths.push(path.join(fontDir, subset));
+  } catch {
+    // font directory unavailable
+  }
+  paths.push(path.join(fontDir, full));
+  return paths;
+}
+
 async function initRenderer() {
   if (!fontCache) {
     fontCache = [];
@@ -64,12 +141,13 @@ async function initRenderer() {
       ['alimamafangyuanti', 'AlimamaFangYuanTiVF-Thin.ttf']
     ];
     for (const [dir, file] of fontDirs) {
-      try {
-        const fontPath = path.join(assetsPath, 'assets', 'fonts', dir, file);
-        const fontBuffer = await fs.readFile(fontPath);
-        fontCache.push(new Uint8Array(fontBuffer));
-      } catch {
-        // font not available
+      for (const fontPath of await resolveFontPaths(dir, file)) {
+        try {
+          const fontBuffer = await fs.readFile(fontPath);
+          fontCache.push(new Uint8Array(fontBuffer));
+        } catch {
+          // font not available
+        }
       }
     }
   }
@@ -100,12 +178,172 @@ async function convertAvifToPng(avifBuffer: Buffer): Promise<Uint8Array> {
   }
 }
 
+interface PackIndex {
+  version: number;
+  alignment: number;
+  size: number;
+  // relative path → [offset, length, format, sha256]
+  files: Record<string, [number, number, string, string]>;
+}
+
+interface AssetPack {
+  handle: fs.FileHandle;
+  files: PackIndex['files'];
+}
+
+async function assetPackFileStamp(): Promise<string> {
+  const packDir = path.join(assetRoot, 'pack');
+  try {
+    const [index, blob] = await Promise.all([
+      fs.stat(path.join(packDir, 'index.json')),
+      fs.stat(path.join(packDir, 'assets.bin'))
+    ]);
+    return `${index.ino}:${index.mtimeMs}:${blob.ino}:${blob.mtimeMs}`;
+  } catch {
+    return '';
+  }
+}
+
+// assets/pack (convert_milthm_assets.py pack): one blob kept open until the pack changes,
+// so each asset is a single positioned read instead of open/stat/read/close
+async function loadAssetPack(): Promise<AssetPack | null> {
+  if (!assetPackPromise) {
+    assetPackPromise = (async () => {
+      let handle: fs.FileHandle | null = null;
+      // Taken before reading, so a pack replaced while loading is picked up by the next render
+      assetPackStamp = await assetPackFileStamp();
+      try {
+        const packDir = path.join(assetRoot, 'pack');
+        const index = JSON.parse(
+          await fs.readFile(path.join(packDir, 'index.json'), 'utf-8')
+        ) as PackIndex;
+        handle = await fs.open(path.join(packDir, 'assets.bin'), 'r');
+        if (index.version !== 1 || (await handle.stat()).size !== index.size) {
+          await handle.close();
+          return null;
+        }
+        return { handle, files: index.files };
+      } catch {
+        await handle?.close().catch(() => {});
+        return null;
+      }
+    })();
+  }
+  return assetPackPromise;
+}
+
+// Read an asset by its path relative to assets/, from the pack when present
+async function readAsset(relativePath: string): Promise<Buffer> {
+  const pack = await loadAssetPack();
+  const entry = pack?.files[relativePath];
+  if (pack && entry) {
+    const [offset, length] = entry;
+    const data = Buffer.allocUnsafe(length);
+    const { bytesRead } = await pack.handle.read(data, 0, length, offset);
+    if (bytesRead === length) return data;
+  }
+  return fs.readFile(path.join(assetRoot, relativePath));
+}
+
+interface RuntimeIndex {
+  files: Record<string, { file: string; format: string }>;
+}
+
+// source path (e.g. icons/0.avif) → runtime tier file picked by --runtime-tier auto
+async function loadRuntimeIndex(): Promise<RuntimeIndex['files']> {
+  if (!runtimeIndexPromise) {
+    runtimeIndexPromise = (async () => {
+      try {
+        const indexPath = path.join(assetRoot, 'runtime', 'index.json');
+        return (JSON.parse(await fs.readFile(indexPath, 'utf-8')) as RuntimeIndex).files;
+      } catch {
+        return {};
+      }
+    })();
+  }
+  return runtimeIndexPromise;
+}
+
+interface IconAtlas {
+  image: string;
+  icons: Record<string, { file: string; x: number; y: number; w: number; h: number }>;
+}
+
+// atlas/icons.png (convert_milthm_assets.py --icon-atlas): a single read and decode
+// yields every level/grade/star icon, keyed like loadAvifImage paths (icons/<file>)
+async function loadIconAtlas(): Promise<Map<string, Uint8Array>> {
+  if (!iconAtlasPromise) {
+    iconAtlasPromise = (async () => {
+      const icons = new Map<string, Uint8Array>();
+      let sheet: any = null;
+      try {
+        const indexPath = path.join(assetRoot, 'atlas', 'icons.json');
+        const index = JSON.parse(await fs.readFile(indexPath, 'utf-8')) as IconAtlas;
+        const vips = await initVips();
+        sheet = vips.Image.newFromBuffer(await readAsset(`atlas/${index.image}`));
+        for (const { file, x, y, w, h } of Object.values(index.icons)) {
+          const icon = sheet.extractArea(x, y, w, h);
+          try {
+            icons.set(
+              `icons/${file}`,
+              new Uint8Array(icon.writeToBuffer('.png', { compression: 6 }))
+            );
+          } finally {
+            try {
+              icon[Symbol.dispose]();
+            } catch {}
+          }
+        }
+      } catch {
+        // atlas not built, icons are loaded one by one
+      } finally {
+        if (sheet) {
+          try {
+            sheet[Symbol.dispose]();
+          } catch {}
+        }
+      }
+      return icons;
+    })();
+  }
+  return iconAtlasPromise;
+}
+
 async function loadAvifImage(relativePath: string): Promise<Uint8Array | null> {
   const cached = pngCache.get(relativePath);
   if (cached) return cached;
-  const fullPath = path.join(assetsPath, 'assets', relativePath);
+  if (relativePath.startsWith('icons/')) {
+    const atlasIcon = (await loadIconAtlas()).get(relativePath);
+    if (atlasIcon) return atlasIcon;
+  }
+  // Format chosen per asset by the auto runtime tier: PNG/WebP go to the renderer as-is,
+  // only AVIF still needs wasm-vips
+  const runtimeEntry = (await loadRuntimeIndex())[relativePath];
+  if (runtimeEntry) {
+    try {
+      const runtimeData = await readAsset(`runtime/${runtimeEntry.file}`);
+      const imageData =
+        runtimeEntry.format === 'AVIF'
+          ? await convertAvifToPng(runtimeData)
+          : new Uint8Array(runtimeData);
+      if (pngCache.size < 200) pngCache.set(relativePath, imageData);
+      return imageData;
+    } catch {
+      // fall through to the fixed-format runtime tier / source
+    }
+  }
+  // Prefer the pre-decoded PNG runtime tier (convert_milthm_assets.py --runtime-tier png)
   try {
-    const avifBuffer = await fs.readFile(fullPath);
+    const pngData = new Uint8Array(
+      await readAsset(`runtime/${relativePath.replace(/\.avif$/i, '.png')}`)
+    );
+    if (pngCache.size < 200) pngCache.set(relativePath, pngData);
+    return pngData;
+  } catch {
+    // runtime tier not built, decode the AVIF source
+  }
+  try {
+    const avifBuffer = await readAsset(relativePath);
     const pngData = await convertAvifToPng(avifBuffer);
     if (pngCache.size < 200) pngCache.set(relativePath, pngData);
     return pngData;
@@ -118,17 +356,39 @@ function registerImage(r: Renderer, key: string, data: Uint8Array) {
   r.putPersistentImage({ src: key, data });
 }
 
-// song name → webp filename, built from assets/covers/cover-map.json
+// Same normalization as normalize_title in convert_milthm_assets.py
+function normalizeTitle(title: string): string {
+  return title.normalize('NFC').replace(/\s+/g, ' ').trim();
+}
+
+interface CoverIndex {
+  covers: { file: string }[];
+  titles: Record<string, number>;
+}
+
+// normalized song name → webp filename, built from assets/covers/cover-index.json
+// (falls back to the legacy cover-map.json)
 async function loadCoverMap(): Promise<Map<string, string>> {
   if (!illustrationMapPromise) {
     illustrationMapPromise = (async () => {
       const map = new Map<string, string>();
       try {
-        const mapPath = path.join(assetsPath, 'assets', 'covers', 'cover-map.json');
+        const indexPath = path.join(assetRoot, 'covers', 'cover-index.json');
+        const index = JSON.parse(await fs.readFile(indexPath, 'utf-8')) as CoverIndex;
+        for (const [title, coverId] of Object.entries(index.titles)) {
+          const cover = index.covers[coverId];
+          if (cover) map.set(title, cover.file);
+        }
+        return map;
+      } catch {
+        // cover index unavailable
+      }
+      try {
+        const mapPath = path.join(assetRoot, 'covers', 'cover-map.json');
         const raw = await fs.readFile(mapPath, 'utf-8');
         const obj = JSON.parse(raw) as Record<string, string>;
         for (const [title, filename] of Object.entries(obj)) {
-          map.set(title, filename);
+          map.set(normalizeTitle(title), filename);
         }
       } catch {
         // cover map unavailable
@@ -139,28 +399,67 @@ async function loadCoverMap(): Promise<Map<string, string>> {
   return illustrationMapPromise;
 }
 
-async function loadCoverForChart(chartId: string, songName: string): Promise<Uint8Array | null> {
-  const cacheKey = `cover:${chartId}`;
-  const cached = pngCache.get(cacheKey);
-  if (cached) return cached;
+interface PlaceholderIndex {
+  version: number;
+  size: [number, number];
+  covers: Record<string, { color: string; data: string }>;
+}
+
+// cover filename → tiny WebP placeholder (covers/placeholders.json, decoded once)
+async function loadCoverPlaceholders(): Promise<Map<string, Uint8Array>> {
+  if (!placeholderPromise) {
+    placeholderPromise = (async () => {
+      const map = new Map<string, Uint8Array>();
+      try {
+        const indexPath = path.join(assetRoot, 'covers', 'placeholders.json');
+        const index = JSON.parse(await fs.readFile(indexPath, 'utf-8')) as PlaceholderIndex;
+        for (const [filename, { data }] of Object.entries(index.covers ?? {})) {
+          map.set(filename, new Uint8Array(Buffer.from(data, 'base64')));
+        }
+      } catch {
+        // placeholder index unavailable
+      }
+      return map;
+    })();
+  }
+  return placeholderPromise;
+}
 
+async function loadCoverForChart(
+  chartId: string,
+  songName: string,
+  quick = false
+): Promise<Uint8Array | null> {
   // First try chart_id lookup (virtual:milthm-covers, built from out.json)
   let filename: string | undefined = coversData[chartId];
-  // Fallback to song name lookup (cover-map.json)
+  // Fallback to song name lookup (cover-index.json / cover-map.json)
   if (!filename) {
     const coverMap = await loadCoverMap();
-    filename = coverMap.get(songName);
+    filename = coverMap.get(normalizeTitle(songName));
   }
   if (!filename) return null;
 
-  const coverPath = path.join(assetsPath, 'assets', 'covers', filename);
-  try {
-    const data = new Uint8Array(await fs.readFile(coverPath));
-    if (pngCache.size < 200) pngCache.set(cacheKey, data);
-    return data;
-  } catch {
-    return null;
+  // Quick renders use the inline placeholder only, skipping cover file reads
+  if (quick) return (await loadCoverPlaceholders()).get(filename) ?? null;
+
+  // Cache by file so charts sharing a (deduplicated) illustration share one entry
+  const cacheKey = `cover:${filename}`;
+  const cached = pngCache.get(cacheKey);
+  if (cached) return cached;
+
+  // Prefer the card-sized 2x variant (covers/2x/*), fall back to the full-size cover
+  const coverPaths = [`covers/2x/${filename}`, `covers/${filename}`];
+  for (const coverPath of coverPaths) {
+    try {
+      const data = new Uint8Array(await readAsset(coverPath));
+      if (pngCache.size < 200) pngCache.set(cacheKey, data);
+      return data;
+    } catch {
+      // try next candidate
+    }
   }
+  // Missing or unreadable cover: fall back to the placeholder
+  return (await loadCoverPlaceholders()).get(filename) ?? null;
 }
 
 function getLevelIconName(item: ProcessedScore): string {
@@ -348,11 +647,14 @@ export interface ChartProgress {
 export async function generateB20Image(
   _ctx: Context | null,
   result: B20Result,
-  userInfo?: B20UserInfo
+  userInfo?: B20UserInfo,
+  options?: { quick?: boolean }
 ): Promise<Buffer> {
+  await refreshAssetRoot();
   const r = await initRenderer();
   await initVips();
   const renderKeyPrefix = `render_${Date.now()}_${++renderSequence}`;
+  const quick = options?.quick ?? false;
 
   const items = result.best20;
   const extras = result.extras ?? [];
@@ -404,7 +706,7 @@ export async function generateB20Image(
   const [coverResults, extrasCoverResults, iconResults] = await Promise.all([
     Promise.all(
       items.map((item, i) =>
-        loadCoverForChart(item.chart_id, item.name).then((png) => ({
+        loadCoverForChart(item.chart_id, item.name, quick).then((png) => ({
           i,
           key: `${renderKeyPrefix}_cover_${i}`,
           png
@@ -413,7 +715,7 @@ export async function generateB20Image(
     ),
     Promise.all(
       extras.map((item, i) =>
-        loadCoverForChart(item.chart_id, item.name).then((png) => ({
+        loadCoverForChart(item.chart_id, item.name, quick).then((png) => ({
           i,
           key: `${renderKeyPrefix}_ex_cover_${i}`,
           png
@@ -530,8 +832,7 @@ export async function generateB20Image(
   const AVATAR_SIZE = 80;
   let avatarImageKey: string | null = null;
   try {
-    const avatarPath = path.join(assetsPath, 'assets', 'icons', 'avatar.webp');
-    const avatarData = new Uint8Array(await fs.readFile(avatarPath));
+    const avatarData = new Uint8Array(await readAsset('icons/avatar.webp'));
     avatarImageKey = `${renderKeyPrefix}_avatar`;
     registerImage(r, avatarImageKey, avatarData);
   } catch {
@@ -541,8 +842,7 @@ export async function generateB20Image(
   // ===== 预加载 v3 badge 背景图 =====
   let v3BadgeImageKey: string | null = null;
   try {
-    const v3BgPath = path.join(assetsPath, 'assets', 'badges', 'v3-bg.webp');
-    const v3BgData = new Uint8Array(await fs.readFile(v3BgPath));
+    const v3BgData = new Uint8Array(await readAsset('badges/v3-bg.webp'));
     v3BadgeImageKey = `${renderKeyPrefix}_v3badge`;
     registerImage(r, v3BadgeImageKey, v3BgData);
   } catch {